@@ -0,0 +1,294 @@
+""" Throughput benchmarks of the simulator, the sensors and the renderers
+
+Each case is timed call by call, reporting calls per second, latency
+percentiles and peak memory. Results can be saved as json and compared
+with a previous run, e.g. between two commits on the same machine:
+
+    python box2dsim/benchmarks/benchmark.py --output before.json
+    (checkout another commit)
+    python box2dsim/benchmarks/benchmark.py --compare before.json
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+import warnings
+
+import numpy as np
+import pkg_resources
+import matplotlib
+matplotlib.use("Agg")
+
+warnings.filterwarnings("ignore")
+from box2dsim.envs import Box2DSimOneArmEnv, VecBox2DSim
+from box2dsim.envs.Simulator import Box2DSim, VisualSensor, \
+        TestPlotter, FrameRenderer
+from box2dsim.envs import convert2pixels
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+SCENES = {
+    "arm": "models/arm.json",
+    "two_arms": "models/two_arms.json"}
+
+
+def scene_file(scene):
+    return pkg_resources.resource_filename("box2dsim", SCENES[scene])
+
+
+def measure(fn, calls, warmup=10, memory=True):
+    """ Time repeated calls of a function
+
+    Args:
+
+        fn (callable): the function to time, called without arguments
+        calls (int): number of timed calls
+        warmup (int): number of untimed calls before timing
+        memory (bool): also run the calls under tracemalloc to
+            measure the peak of python allocations
+
+    Returns:
+
+        (dict): calls per second, latency statistics in milliseconds
+            and peak memory in bytes
+    """
+
+    for _ in range(warmup):
+        fn()
+
+    latencies = np.zeros(calls)
+    clock = time.perf_counter
+    for t in range(calls):
+        start = clock()
+        fn()
+        latencies[t] = clock() - start
+
+    result = {
+        "calls": calls,
+        "calls_per_s": calls/latencies.sum(),
+        "latency_ms": {
+            "mean": 1e3*latencies.mean(),
+            "p50": 1e3*np.percentile(latencies, 50),
+            "p90": 1e3*np.percentile(latencies, 90),
+            "p99": 1e3*np.percentile(latencies, 99),
+            "max": 1e3*latencies.max()}
+        }
+
+    if memory:
+        # tracemalloc slows down allocations, so it runs
+        # in a separate pass
+        tracemalloc.start()
+        for _ in range(min(calls, 100)):
+            fn()
+        result["peak_python_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    # ru_maxrss is in kilobytes on linux
+    result["max_rss_bytes"] = \
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+    return result
+
+
+def random_actions(space, rng):
+    return rng.uniform(space.low, space.high)
+
+
+def uncached(sim, fn):
+    """ Call fn after forgetting the cached body poses, so that
+    sensors and renderers draw again instead of reusing their image
+    """
+    def call():
+        sim.invalidate_poses()
+        return fn()
+    return call
+
+
+def plotter_env(sim):
+    """ The minimal environment a renderer needs around a simulator
+    """
+    return types.SimpleNamespace(sim=sim,
+            robot_parts_names=[name for name in sim.bodies
+                if not name.startswith("Object")])
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+def cases(args):
+    """ Generate the benchmark cases
+
+    Args:
+
+        args (Namespace): the command line arguments
+
+    Yields:
+
+        (string, dict, callable): name, parameters and
+            the function to time
+    """
+
+    rng = np.random.RandomState(0)
+
+    for scene in args.scenes:
+        sim = Box2DSim(scene_file(scene))
+        params = {"scene": scene}
+        yield "Box2DSim.step", params, sim.step
+
+        for size in args.retina_sizes:
+            sensor = VisualSensor(sim, (size, size), (40, 40))
+            params = {"scene": scene, "retina_size": size}
+            yield "VisualSensor.step", params, uncached(sim,
+                    lambda sensor=sensor: sensor.step((10, 10)))
+
+        # the matplotlib reference rasterizers
+        sensor = VisualSensor(sim, (40, 40), (40, 40))
+        vertices = list(sim.world_vertices())
+        yield "VisualSensor.path2pixels", {"scene": scene,
+                "retina_size": 40}, lambda sensor=sensor, vertices=vertices: \
+                [sensor.path2pixels(v, (10, 10)) for v in vertices]
+        yield "convert2pixels.path2pixels", {"scene": scene,
+                "resize": 40}, lambda vertices=vertices: \
+                [convert2pixels.path2pixels(v, (-10, 30), (-10, 30),
+                    (40, 40)) for v in vertices]
+        yield "convert2pixels.path2pixels", {"scene": scene,
+                "resize": 40, "batch": True}, lambda vertices=vertices: \
+                convert2pixels.path2pixels(vertices, (-10, 30), (-10, 30),
+                    (40, 40))
+
+        penv = plotter_env(sim)
+        with tempfile.TemporaryDirectory() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                plotter = TestPlotter(penv, offline=True)
+                yield "TestPlotter.step", {"scene": scene,
+                        "mode": "offline"}, uncached(sim, plotter.step)
+                matplotlib.pyplot.close(plotter.fig)
+            finally:
+                os.chdir(cwd)
+        plotter = TestPlotter(penv)
+        yield "TestPlotter.step", {"scene": scene, "mode": "human"}, \
+                uncached(sim, plotter.step)
+        matplotlib.pyplot.close(plotter.fig)
+        renderer = FrameRenderer(penv)
+        yield "FrameRenderer.draw", {"scene": scene}, \
+                uncached(sim, renderer.draw)
+
+    # the one-arm environment is bound to arm.json
+    if "arm" in args.scenes:
+        env = Box2DSimOneArmEnv()
+        env.reset()
+        params = {"scene": "arm"}
+        yield "Box2DSimOneArmEnv.step", params, lambda: \
+                env.step(random_actions(env.action_space, rng))
+        yield "Box2DSimOneArmEnv.get_observation", params, \
+                env.get_observation
+
+        for num_envs in args.num_envs:
+            venv = VecBox2DSim(num_envs)
+            venv.reset()
+            params = {"scene": "arm", "num_envs": num_envs}
+            yield "VecBox2DSim.step", params, lambda venv=venv: \
+                venv.step(random_actions(venv.action_space, rng))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def key(result):
+    return result["name"] + " " + json.dumps(result["params"],
+            sort_keys=True)
+
+
+def run(args):
+    results = []
+    for name, params, fn in cases(args):
+        if args.filter is not None and args.filter not in name:
+            continue
+        # rendering and rasterization with matplotlib are slow
+        calls = args.calls
+        if "path2pixels" in name or "TestPlotter" in name:
+            calls = max(1, calls//10)
+        result = measure(fn, calls, warmup=min(10, calls),
+                memory=not args.no_memory)
+        # for batched envs steps/s counts the steps of single worlds
+        result["steps_per_s"] = result["calls_per_s"]* \
+                params.get("num_envs", 1)
+        result.update(name=name, params=params)
+        results.append(result)
+        print("%-36s %-40s %10.1f steps/s  p50 %8.3f ms  p99 %8.3f ms" % (
+            name, json.dumps(params), result["steps_per_s"],
+            result["latency_ms"]["p50"], result["latency_ms"]["p99"]))
+        sys.stdout.flush()
+
+    report = {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "results": results}
+    return report
+
+
+def compare(report, baseline):
+    """ Print the ratios of steps/s between a run and a baseline
+    """
+    previous = {key(r): r for r in baseline["results"]}
+    print("\nspeedup with respect to %s (%s)" % (
+        baseline.get("revision"), baseline.get("time")))
+    for result in report["results"]:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        print("%-36s %-40s %8.2fx" % (result["name"],
+            json.dumps(result["params"]),
+            result["steps_per_s"]/old["steps_per_s"]))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=1000,
+            help="timed calls of each case")
+    parser.add_argument("--scenes", nargs="+", default=list(SCENES),
+            choices=list(SCENES))
+    parser.add_argument("--retina-sizes", type=int, nargs="+",
+            default=[20, 80, 160])
+    parser.add_argument("--num-envs", type=int, nargs="+",
+            default=[1, 8, 64])
+    parser.add_argument("--filter", default=None,
+            help="only run the cases whose name contains this string")
+    parser.add_argument("--no-memory", action="store_true",
+            help="skip the tracemalloc pass")
+    parser.add_argument("--output", default=None,
+            help="save the results into this json file")
+    parser.add_argument("--compare", default=None,
+            help="a json file from a previous run")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
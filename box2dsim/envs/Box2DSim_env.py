@@ -1,7 +1,9 @@
+import collections
 import numpy as np
 import gym
 from gym import spaces
-from .Simulator import Box2DSim as Sim, TestPlotter, VisualSensor 
+from .Simulator import Box2DSim as Sim, TestPlotter, VisualSensor, \
+        FrameRenderer, FrameRecorder
 import pkg_resources
 from scipy import ndimage
 
@@ -10,20 +12,178 @@ def softmax(x, t=0.01):
     return e/e.sum()
 
 def DefaultRewardFun(observation):
-    return np.sum(observation['TOUCH_SENSORS'])
+    sensors = observation['TOUCH_SENSORS']
+    if isinstance(sensors, dict):
+        sensors = list(sensors.values())
+    return np.sum(sensors)
+
+def DefaultDoneFun(observation):
+    return False
+
+def sample_object_poses(sim, object_names, init_range, rng):
+    """ Sample initial object poses around the ones in the world file
+
+    Args:
+
+        sim (Box2DSim): a simulator object
+        object_names (list): names of the objects to move
+        init_range (array-like): half-widths of the uniform noise
+            added to x, y and angle
+        rng (np.random.RandomState): the random generator
+
+    Returns:
+
+        (dict): name -> (x, y, angle)
+    """
+
+    init_range = np.asarray(init_range, dtype=float)
+    return {name: sim.initial_pose(name) + 
+            rng.uniform(-init_range, init_range) 
+            for name in object_names}
+
+
+class ActionMapper(object):
+    """ Clip one-arm actions and write them as joint setpoints
+
+    An action holds the angles of the three arm joints and of the two
+    joints of a finger. Arm angles are clipped to [-pi/2, pi/2], finger 
+    angles to [0, pi/2] with the distal one at most twice the proximal 
+    one, and are mirrored onto the joints of the other finger. The 
+    actions of all envs are mapped at once into preallocated buffers and 
+    scattered straight into the controller setpoints.
+    """
+
+    num_actions = 5
+
+    def __init__(self, setpoint, columns):
+        """
+        Args:
+
+            setpoint (np.ndarray): the (num_sim_joints,) or 
+                (num_envs, num_sim_joints) setpoints of the controllers,
+                written in place
+            columns (list): the setpoint index of each joint of the
+                mapped action, in the order of the env joint_names
+
+        """
+
+        self.setpoint = setpoint.reshape(-1, setpoint.shape[-1])
+        assert np.shares_memory(self.setpoint, setpoint)
+        self.columns = np.array(columns)
+        num_envs = len(self.setpoint)
+        self.actions = np.zeros([num_envs, self.num_actions])
+        self.setpoints = np.zeros([num_envs, len(self.columns)])
+        self._fingers = np.zeros([num_envs, 2])
+        # views used at each call, built once since slicing
+        # costs as much as operating on a few values
+        self._arm = self.actions[:, :3], self.setpoints[:, :3]
+        self._proximal = self.actions[:, 3], self._fingers[:, 0]
+        self._distal = self.actions[:, 4], self._fingers[:, 1]
+        self._mirror = self.setpoints[:, 5:], self.setpoints[:, 3:5]
+
+    def __call__(self, actions):
+        """ Map actions onto setpoints
+
+        Args:
+
+            actions (np.ndarray): a (5,) action for a single env or a
+                (num_envs, 5) array of actions
+
+        Returns:
+
+            (np.ndarray): the (num_envs, 7) setpoints, 
+                in the order of the env joint_names
+        """
+
+        actions = np.asarray(actions)
+        if actions.shape[-1] != self.num_actions or \
+                actions.size != self.actions.size:
+            raise ValueError("actions of shape %s, expected %s" % (
+                actions.shape, self.actions.shape))
+        self.actions[:] = actions.reshape(self.actions.shape)
+        hp = np.pi*0.5
+
+        arm_action, arm = self._arm
+        np.minimum(arm_action, hp, out=arm)
+        np.maximum(arm, -hp, out=arm)
+
+        proximal_action, proximal = self._proximal
+        distal_action, distal = self._distal
+        proximal[:] = proximal_action
+        np.multiply(proximal_action, 2, out=distal)
+        np.minimum(distal, distal_action, out=distal)
+        fingers, mirrored = self._mirror
+        np.minimum(self._fingers, hp, out=fingers)
+        np.maximum(fingers, 0, out=fingers)
+        np.negative(fingers, out=mirrored)
+
+        self.setpoint[:, self.columns] = self.setpoints
+        return self.setpoints
+
+
+class LazyObservation(collections.abc.Mapping):
+    """ A dictionary observation whose expensive components are 
+    computed on first access
+
+    Components are computed from the current state of the simulation,
+    so they must be read before the env is stepped, reset or restored:
+    reading a component for the first time afterwards raises a 
+    RuntimeError.
+    """
+
+    def __init__(self, env, keys, values, pending):
+        """
+        Args:
+
+            env (Box2DSimOneArmEnv): the env that made the observation
+            keys (list): all the keys of the observation, in order
+            values (dict): the components already computed
+            pending (dict): key -> function computing each of the others
+
+        """
+
+        self._env = env
+        self._version = env.state_version
+        self._keys = keys
+        self._values = values
+        self._pending = pending
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            if key not in self._pending:
+                raise KeyError(key)
+            if self._env.state_version != self._version:
+                raise RuntimeError("the observation %s was read after the "
+                        "env changed state" % key)
+            self._values[key] = self._pending.pop(key)()
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
 
 
 class Box2DSimOneArmEnv(gym.Env):
     """ A single 2D arm Box2DSimwith a box-shaped object
     """
     
-    metadata = {'render.modes': ['human', 'offline']}
+    metadata = {'render.modes': ['human', 'offline', 'rgb_array', 'record']}
+
+    # all the components an observation can have, RETINA is off
+    # unless selected with set_observation_components
+    observation_keys = ["JOINT_POSITIONS", "TOUCH_SENSORS", 
+            "OBJ_POSITION", "RETINA"]
+    # components computed on first access with lazy observations 
+    lazy_keys = ["TOUCH_SENSORS", "RETINA"]
     
     def __init__(self):
 
         super(Box2DSimOneArmEnv, self).__init__()
 
         world_file = pkg_resources.resource_filename('box2dsim', 'models/arm.json')   
+        self.world_file = world_file
         self.sim = Sim(world_file)
 
         self.robot_parts_names = ['Base', 'Arm1', 'Arm2',
@@ -36,90 +196,589 @@ class Box2DSimOneArmEnv(gym.Env):
 
         self.object_names = ["Object"]
 
+        self.parts_indices = [self.sim.body_index[name] 
+                for name in self.robot_parts_names]
+        self.object_indices = [self.sim.body_index[name] 
+                for name in self.object_names]
+        self._reward_touch_indices = np.ix_(self.parts_indices, 
+                self.object_indices)
+
         self.num_joints = 5
         self.num_touch_sensors = 7
 
+        self.action_mapper = ActionMapper(self.sim.pids.setpoint,
+                [self.sim.joint_index[name] for name in self.joint_names])
+
         # Define action and observation space
         # They must be gym.spaces objects
         # Example when using discrete actions:
         self.action_space = spaces.Box(
             -np.pi, np.pi, [self.num_joints], dtype = float)
-        
-        self.observation_space = gym.spaces.Dict({
-            "JOINT_POSITIONS": gym.spaces.Box(-np.inf, np.inf, [self.num_joints], dtype = float),
-            "TOUCH_SENSORS": gym.spaces.Dict({ 
-                obj_name: gym.spaces.Box(0, np.inf, [self.num_touch_sensors], dtype = float)
-                for obj_name in self.object_names}),
-            "OBJ_POSITION": gym.spaces.Box(-np.inf, np.inf, [len(self.object_names), 2], dtype = float)
-            })
        
         self.rendererType = TestPlotter
         self.renderer = None
+        self.frame_renderer = None
+        # set to a FrameRecorder to choose file, size and frame skip 
+        # of render(mode='record')
+        self.recorder = None
+        # render(mode='human') updates the figure once every 
+        # render_interval calls
+        self.render_interval = 1
         self.taskspace_xlim = [-10, 30]
         self.taskspace_ylim = [-10, 30]
 
+        # half-widths of the uniform noise added to the initial x, y and
+        # angle of the objects at reset. None keeps the world file poses
+        self.object_init_range = None
+        self.rng = np.random.RandomState()
+
+        self.profiler = None
+        self.rollout_writer = None
+
+        # number of simulation steps run with each action. Observation
+        # and reward are computed once, after the last one
+        self.action_repeat = 1
+        # if True touch sensors report the largest number of contacts
+        # reached during the steps of the last action instead of the 
+        # contacts at its end
+        self.accumulate_touches = False
+
+        # computes each observation component
+        self.observation_functions = {
+                "JOINT_POSITIONS": self.get_joint_positions,
+                "TOUCH_SENSORS": self.get_touch_sensors,
+                "OBJ_POSITION": self.get_obj_position,
+                "RETINA": self.get_retina}
+        self.visual_sensor = None
+        self.retina_focus = None
+        # incremented whenever the simulation changes state, 
+        # see LazyObservation
+        self.state_version = 0
+
+        self.observation_mode = "dict"
+        self.set_observation_components()
         self.set_reward_fun()
+        self.set_done_fun()
 
     def set_reward_fun(self, rew_fun=None):    
 
         self.reward_fun = rew_fun     
         if self.reward_fun is None:
-            self.reward_fun = DefaultRewardFun
+            self.reward_fun = self.default_reward
+
+    def default_reward(self, observation):
+        """ The number of contacts between the robot parts and the
+        objects, the same as DefaultRewardFun
+
+        It is read from the simulation, so that it does not depend on
+        the observed components and does not compute lazy ones.
+        """
+        touches = self.touch_matrix()
+        return np.sum(touches[self._reward_touch_indices])
+
+    def set_done_fun(self, done_fun=None):
+        """ Set the termination function
+
+        Args:
+
+            done_fun (callable): a function taking the observation 
+                dictionary, like the reward function, and returning 
+                whether the episode ended. Defaults to episodes that
+                never end
+
+        """
+
+        self.done_fun = done_fun
+        if self.done_fun is None:
+            self.done_fun = DefaultDoneFun
+
+    def seed(self, seed=None):
+        """ Seed the random generators of the env
+
+        Covers the initial object poses drawn at reset (see
+        object_init_range) and action_space.sample(). The simulation 
+        itself is deterministic, so the same seed and actions give
+        bit-identical observations.
+
+        Args:
+
+            seed (int): the seed, a random one if None
+
+        Returns:
+
+            (list): the seed used
+        """
+
+        if seed is None:
+            seed = int(np.random.randint(2**31))
+        self.rng = np.random.RandomState(seed)
+        self.action_space.seed(seed)
+        return [seed]
+
+    def set_observation_components(self, components=None, lazy=False,
+            retina_size=(40, 40), retina_range=(40, 40), focus=(10, 10)):
+        """ Choose the components computed at each observation
+
+        Components that are not selected are never computed and are
+        missing from observations and from observation_space. step,
+        reset and observe can also compute fewer components than the
+        selected ones in a single call.
+
+        Args:
+
+            components (list): some of observation_keys, defaults to
+                JOINT_POSITIONS, TOUCH_SENSORS and OBJ_POSITION
+            lazy (bool): if True, in "dict" mode TOUCH_SENSORS and RETINA
+                are computed when first read from the observation,
+                see LazyObservation
+            retina_size (int, int): width, height of the RETINA
+            retina_range (float, float): retina range in the task space
+            focus (float, float): retina center in the task space, 
+                later changed through retina_focus
+
+        """
+
+        if components is None:
+            components = ["JOINT_POSITIONS", "TOUCH_SENSORS", "OBJ_POSITION"]
+        unknown = set(components) - set(self.observation_keys)
+        if unknown:
+            raise ValueError("unknown observation components %s" % 
+                    sorted(unknown))
+        self.observation_components = [key for key in self.observation_keys
+                if key in components]
+        self.lazy_observations = lazy
+
+        if "RETINA" in components:
+            self.visual_sensor = VisualSensor(self.sim, retina_size, 
+                    retina_range)
+            self.retina_focus = focus
+
+        component_spaces = {
+            "JOINT_POSITIONS": gym.spaces.Box(-np.inf, np.inf, [self.num_joints], dtype = float),
+            "TOUCH_SENSORS": gym.spaces.Dict({ 
+                obj_name: gym.spaces.Box(0, np.inf, [self.num_touch_sensors], dtype = float)
+                for obj_name in self.object_names}),
+            "OBJ_POSITION": gym.spaces.Box(-np.inf, np.inf, [len(self.object_names), 2], dtype = float)
+            }
+        if self.visual_sensor is not None:
+            component_spaces["RETINA"] = gym.spaces.Box(0, np.inf, 
+                    tuple(self.visual_sensor.retina.shape), dtype = float)
+        self.dict_observation_space = gym.spaces.Dict({key: 
+            component_spaces[key] for key in self.observation_components})
+
+        self.set_observation_mode(self.observation_mode)
+
+    def set_observation_mode(self, mode="dict"):
+        """ Choose what env.step and env.reset return as observation
+
+        In "flat" mode the selected components (see 
+        set_observation_components) are written into a single 
+        preallocated float32 vector, returned (and overwritten) at each
+        step. observation_layout maps each key of the dictionary 
+        observation to its (start, stop, shape) in the vector and 
+        observation_space becomes the matching Box. Reward functions 
+        still get a dictionary, made of views over the vector.
+
+        Args:
+
+            mode (string): "dict" (default) or "flat"
+
+        """
+
+        if mode not in ["dict", "flat"]:
+            raise ValueError("unknown observation mode %s" % mode)
+        self.observation_mode = mode
+
+        if mode == "dict":
+            self.observation_space = self.dict_observation_space
+            return
+
+        shapes = {
+            "JOINT_POSITIONS": (len(self.joint_names),),
+            "TOUCH_SENSORS": (len(self.object_names), 
+                len(self.robot_parts_names)),
+            "OBJ_POSITION": (len(self.object_names), 2)}
+        if self.visual_sensor is not None:
+            shapes["RETINA"] = self.visual_sensor.retina.shape
+        self.observation_layout = {}
+        start = 0
+        for key in self.observation_components:
+            shape = shapes[key]
+            stop = start + int(np.prod(shape))
+            self.observation_layout[key] = (start, stop, shape)
+            start = stop
+
+        self.flat_observation = np.zeros(start, dtype=np.float32)
+        self.flat_views = {key: self.flat_observation[start:stop].reshape(shape)
+                for key, (start, stop, shape) in self.observation_layout.items()}
+        self.observation_space = spaces.Box(-np.inf, np.inf, [start], 
+                dtype=np.float32)
+
+        # flat indices of the (objects, parts) block of the touch matrix
+        num_bodies = len(self.sim.body_index)
+        self._flat_touch_indices = np.array([[obj_idx*num_bodies + part_idx
+            for part_idx in self.parts_indices]
+            for obj_idx in self.object_indices])
+        self._flat_joints = [self.sim.joints[name] for name in self.joint_names]
+        self._flat_objects = [self.sim.bodies[name] for name in self.object_names]
+
+    def get_flat_observation(self, components=None):
+        """ Write the current observation into the flat vector
+
+        Args:
+
+            components (list): the components to write, defaults to all
+                the selected ones. The others keep their previous values
+
+        Returns:
+
+            (np.ndarray): the flat observation, see set_observation_mode
+        """
+
+        views = self.flat_views
+        if components is None:
+            components = self.observation_components
+        if "JOINT_POSITIONS" in components:
+            views["JOINT_POSITIONS"][:] = [joint.angle 
+                    for joint in self._flat_joints]
+        if "TOUCH_SENSORS" in components:
+            np.take(self.touch_matrix(), self._flat_touch_indices, 
+                    out=views["TOUCH_SENSORS"])
+        if "OBJ_POSITION" in components:
+            obj_pos = views["OBJ_POSITION"]
+            for o, body in enumerate(self._flat_objects):
+                obj_pos[o] = body.worldCenter
+        if "RETINA" in components:
+            views["RETINA"][:] = self.visual_sensor.step(self.retina_focus)
+
+        return self.flat_observation
+
+    def set_rollout_writer(self, writer=None):
+        """ Store every transition
+
+        Args:
+
+            writer (RolloutWriter): records each step and is told about
+                each reset, see RolloutWriter.from_env. None detaches
+                the current writer, which is not closed.
+
+        """
+
+        self.rollout_writer = writer
+
+    def set_profiler(self, profiler=None):
+        """ Time the phases of each step
+
+        Args:
+
+            profiler (Profiler): accumulates the time spent in set_action,
+                pid, world_step, joints, touch_sensors, obj_position, 
+                retina, observation and reward. None disables profiling.
+
+        Returns:
+
+            (Profiler): the profiler
+        """
+
+        self.profiler = profiler
+        self.sim.profiler = profiler
+        return profiler
 
 
     def set_action(self, action):
 
-        assert(len(action) == self.num_joints)
-        action = np.hstack(action)
-        # do action
-        action[:-2] = np.maximum(-np.pi*0.5, np.minimum(np.pi*0.5, action[:-2]))
-        action[-1] = np.maximum( 0, np.minimum(2*action[-2], action[-1]))
-        action[-2:] = -np.maximum( 0, np.minimum(np.pi*0.5, action[-2:]))
-        action = np.hstack((action, -action[-2:]))
-        for j, joint in enumerate(self.joint_names):
-            self.sim.move(joint, action[j])
-        self.sim.step()  
+        if self.profiler is not None:
+            self.profiler.start()
+        self.action_mapper(action)
+        if self.profiler is not None:
+            self.profiler.lap("set_action")
+        self.state_version += 1
+        if self.accumulate_touches:
+            self.sim.contact_sensors.clear_peaks()
+        for _ in range(self.action_repeat):
+            self.sim.step()  
+
+    def touch_matrix(self):
+        """ The body x body matrix the touch sensors are read from
+        """
+        sensors = self.sim.contact_sensors
+        if self.accumulate_touches:
+            return sensors.peak_touches
+        return sensors.touches
    
-    def get_observation(self):
+    def get_joint_positions(self):
+        """ The angles of the joints, in the order of joint_names
+        """
+        return [self.sim.joints[name].angle for name in self.joint_names]
+
+    def get_touch_sensors(self):
+        """ Object name -> touch intensity at each robot part
+        """
+        touches = self.touch_matrix()
+        return {object_name: touches[self.parts_indices, obj_idx].tolist()
+            for object_name, obj_idx in zip(self.object_names, self.object_indices)}
 
-        joints = [self.sim.joints[name].angle for name in self.joint_names]
-        sensors = {object_name: [self.sim.contacts(part, object_name) 
-            for part in self.robot_parts_names] for object_name in self.object_names}
-        obj_pos = np.array([[self.sim.bodies[object_name].worldCenter]
+    def get_obj_position(self):
+        """ The (num_objects, 1, 2) centers of mass of the objects
+        """
+        return np.array([[self.sim.bodies[object_name].worldCenter]
             for object_name in self.object_names])
+
+    def get_retina(self):
+        """ The retina around retina_focus, see set_observation_components
+        """
+        return self.visual_sensor.step(self.retina_focus).copy()
+   
+    def get_observation(self):
+
+        profiler = self.profiler
+        joints = self.get_joint_positions()
+        if profiler is not None:
+            profiler.lap("joints")
+        sensors = self.get_touch_sensors()
+        if profiler is not None:
+            profiler.lap("touch_sensors")
+        obj_pos = self.get_obj_position()
+        if profiler is not None:
+            profiler.lap("obj_position")
         
         return joints, sensors, obj_pos
 
-    def sim_step(self, action):
-       
-        self.set_action(action)
-        joints, sensors, obj_pos = self.get_observation()
-        
-        observation = {
-            "JOINT_POSITIONS": joints,
-            "TOUCH_SENSORS": sensors,
-            "OBJ_POSITION": obj_pos }
+    def observe(self, components=None):
+        """ The observation of the current state
+
+        Args:
+
+            components (list): the components to compute, defaults to
+                the ones chosen with set_observation_components
+
+        Returns:
+
+            the observation, see set_observation_mode
+        """
+
+        if components is None:
+            components = self.observation_components
+        elif not set(components) <= set(self.observation_components):
+            raise ValueError("observation components %s were not selected "
+                    "with set_observation_components" % sorted(
+                        set(components) - set(self.observation_components)))
+
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
+        if self.observation_mode == "flat":
+            observation = self.get_flat_observation(components)
+            if profiler is not None:
+                profiler.lap("observation")
+            return observation
+
+        phases = {"JOINT_POSITIONS": "joints", 
+                "TOUCH_SENSORS": "touch_sensors",
+                "OBJ_POSITION": "obj_position", "RETINA": "retina"}
+        lazy_keys = self.lazy_keys if self.lazy_observations else []
+        observation = {}
+        pending = {}
+        for key in self.observation_keys:
+            if key not in components:
+                continue
+            if key in lazy_keys:
+                pending[key] = self.observation_functions[key]
+                continue
+            observation[key] = self.observation_functions[key]()
+            if profiler is not None:
+                profiler.lap(phases[key])
+        if pending:
+            observation = LazyObservation(self, 
+                    [key for key in self.observation_keys 
+                        if key in components], observation, pending)
+        if profiler is not None:
+            profiler.lap("observation")
         
         return observation
 
-    def step(self, action):
+    def sim_step(self, action, components=None):
+       
+        self.set_action(action)
+        return self.observe(components)
 
-        observation = self.sim_step(action)
+    def step(self, action, components=None):
 
-        # compute reward
-        reward = self.reward_fun(observation)
+        observation = self.sim_step(action, components)
 
-        # compute end of task
-        done = False 
+        # compute reward and end of task, always from a dictionary
+        observation_dict = self.flat_views \
+                if self.observation_mode == "flat" else observation
+        reward = self.reward_fun(observation_dict)
+        done = bool(self.done_fun(observation_dict))
+        if self.profiler is not None:
+            self.profiler.lap("reward")
+            self.profiler.end_step()
 
         # other info
         info = {}
+
+        if self.rollout_writer is not None:
+            self.rollout_writer.record(self, action, observation, 
+                    reward, done)
         
         return observation, reward, done, info
 
-    def reset(self):
+    def execute_trajectory(self, actions, record=1):
+        """ Run a whole sequence of actions
 
-        self.sim = Sim(world_file)
+        Equivalent to calling step with each action, without the Python
+        round trip of each step: all actions are mapped onto joint 
+        setpoints at once and the observation of a step is only 
+        computed if it is recorded, straight into preallocated arrays. 
+        The rollout writer and the renderers are not updated.
+
+        Args:
+
+            actions (np.ndarray): a (T, 5) sequence of actions
+            record (int): record the steps k - 1, 2k - 1, ... 
+                where k = record
+
+        Returns:
+
+            (dict, np.ndarray, np.ndarray): the recorded observations,
+                a (T//k, ...) array for each selected observation 
+                component (TOUCH_SENSORS is (T//k, num_objects, 
+                num_parts)), and the (T//k,) rewards and done flags 
+                of the recorded steps
+        """
+
+        actions = np.asarray(actions, dtype=float)
+        num_steps = len(actions)
+        num_records = num_steps//record
+        components = list(self.observation_components)
+        shapes = {
+            "JOINT_POSITIONS": (len(self.joint_names),),
+            "TOUCH_SENSORS": (len(self.object_names), 
+                len(self.robot_parts_names)),
+            "OBJ_POSITION": (len(self.object_names), 2)}
+        if self.visual_sensor is not None:
+            shapes["RETINA"] = self.visual_sensor.retina.shape
+        observations = {key: np.zeros((num_records,) + shapes[key]) 
+                for key in components}
+        rewards = np.zeros(num_records)
+        dones = np.zeros(num_records, dtype=bool)
+
+        # the setpoints of all steps in a single pass
+        pid_setpoint = self.sim.pids.setpoint
+        setpoints = np.repeat(pid_setpoint[None], num_steps, axis=0)
+        ActionMapper(setpoints, self.action_mapper.columns)(actions)
+
+        sim = self.sim
+        sensors = sim.contact_sensors
+        joints = [sim.joints[name] for name in self.joint_names]
+        objects = [sim.bodies[name] for name in self.object_names]
+        num_bodies = len(sim.body_index)
+        touch_indices = np.array([[obj_idx*num_bodies + part_idx
+            for part_idx in self.parts_indices]
+            for obj_idx in self.object_indices])
+        rows = [{key: observations[key][r] for key in components} 
+                for r in range(num_records)]
+
+        for t in range(num_steps):
+            pid_setpoint[:] = setpoints[t]
+            if self.accumulate_touches:
+                sensors.clear_peaks()
+            for _ in range(self.action_repeat):
+                sim.step()
+            if (t + 1) % record != 0:
+                continue
+            r = t//record
+            row = rows[r]
+            if "JOINT_POSITIONS" in row:
+                row["JOINT_POSITIONS"][:] = [joint.angle for joint in joints]
+            if "TOUCH_SENSORS" in row:
+                np.take(self.touch_matrix(), touch_indices, 
+                        out=row["TOUCH_SENSORS"])
+            if "OBJ_POSITION" in row:
+                row["OBJ_POSITION"][:] = [body.worldCenter 
+                        for body in objects]
+            if "RETINA" in row:
+                row["RETINA"][:] = self.visual_sensor.step(self.retina_focus)
+            # reward and end of task from views, as in flat mode
+            rewards[r] = self.reward_fun(row)
+            dones[r] = self.done_fun(row)
+
+        self.state_version += 1
+        return observations, rewards, dones
+
+    def reset(self, components=None):
+
+        body_poses = None
+        if self.object_init_range is not None:
+            body_poses = sample_object_poses(self.sim, self.object_names,
+                    self.object_init_range, self.rng)
+        # restore the world in place instead of rebuilding it from file
+        self.sim.reset(body_poses)
+        self.state_version += 1
+        if self.rollout_writer is not None:
+            self.rollout_writer.new_episode()
+
+        return self.observe(components)
+
+    def get_state(self, out=None):
+        """ The state of the simulation as a flat array
+
+        Args:
+
+            out (np.ndarray): optional (sim.state_size,) output buffer
+
+        Returns:
+
+            (np.ndarray): the state, see Box2DSim.get_state
+        """
+
+        return self.sim.get_state(out)
+
+    def set_state(self, state):
+        """ Restore in place a state returned by get_state
+
+        The same state and actions always give the same observations,
+        but they can slightly differ from the ones of the simulation 
+        the state was taken from (see Box2DSim.set_state). Restore the 
+        env too before executing the actions chosen on a branch.
+
+        Args:
+
+            state (np.ndarray): the state
+
+        Returns:
+
+            the observation in the restored state
+        """
+
+        self.sim.set_state(state)
+        self.state_version += 1
+        return self.observe()
+
+    def fork(self, num_branches, state=None):
+        """ Branches of the simulation, stepped as a batch
+
+        Args:
+
+            num_branches (int): number of branches
+            state (np.ndarray): the state of all branches, defaults to 
+                the current state of the env
+
+        Returns:
+
+            (VecBox2DSim): a batch of worlds set to the state. Call 
+                its set_state to start new branches from other states
+                without building new worlds.
+        """
+
+        from .VecBox2DSim_env import VecBox2DSim
+
+        if state is None:
+            state = self.get_state()
+        branches = VecBox2DSim(num_branches, self.world_file, dt=self.sim.dt)
+        branches.set_state(state)
+        return branches
 
     def render(self, mode='human'):
 
@@ -127,12 +786,33 @@ class Box2DSimOneArmEnv(gym.Env):
             if self.renderer is None:
                 self.renderer = self.rendererType(self, 
                         xlim=self.taskspace_xlim,
-                        ylim=self.taskspace_ylim)
+                        ylim=self.taskspace_ylim,
+                        render_interval=self.render_interval)
         elif mode == 'offline': 
             if self.renderer is None:
                 self.renderer = self.rendererType(self, 
                         xlim=self.taskspace_xlim,
                         ylim=self.taskspace_ylim, offline=True)
+        elif mode == 'rgb_array':
+            if self.frame_renderer is None:
+                self.frame_renderer = FrameRenderer(self,
+                        xlim=self.taskspace_xlim,
+                        ylim=self.taskspace_ylim)
+            return self.frame_renderer.draw()
+        elif mode == 'record':
+            if self.recorder is None:
+                self.recorder = FrameRecorder(self,
+                        xlim=self.taskspace_xlim,
+                        ylim=self.taskspace_ylim)
+            self.recorder.step()
+            return
         self.renderer.step()
+
+    def close(self):
+
+        if self.recorder is not None:
+            self.recorder.close()
  
 
+        if self.rollout_writer is not None:
+            self.rollout_writer.close()
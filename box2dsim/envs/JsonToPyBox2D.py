@@ -1,5 +1,8 @@
 import Box2D as b2
 import json
+import os
+import pickle
+import hashlib
 
 
 
@@ -29,7 +32,7 @@ def updateWorldFromJson(b2_world, filePathName):
     return body_refs, joint_refs
 
 
-def createWorldFromJson(filePathName):
+def createWorldFromJson(filePathName, use_cache=True, cache_dir=None):
     """
     loads json from file to memory
     and returns b2_world from it
@@ -37,10 +40,20 @@ def createWorldFromJson(filePathName):
     :param filePathName: the name of the json file with parameters
     :type filePathName: string
 
+    :param use_cache: build the world from a cached compiled scene
+                      instead of parsing the json file again
+    :type use_cache: bool
+
+    :param cache_dir: optional folder for the on-disk scene cache
+    :type cache_dir: string
+
     :return: two dictionaries for bodies and joints
     :rtype: tuple(dict(string: b2Body), dict(string: b2Joint))
 
     """
+    if use_cache:
+        return createWorldFromScene(loadScene(filePathName, cache_dir))
+
     # load json into memory
     with open(filePathName, "r") as json_file:
         jsw = json.load(json_file)
@@ -54,6 +67,307 @@ def createWorldFromJson(filePathName):
 
     return b2_world, body_refs, joint_refs
 
+#------------------------------------------------------------------------------
+# compiled scenes
+#------------------------------------------------------------------------------
+
+BODY_DEF_ATTRS = ("type", "position", "angle", "linearVelocity",
+        "angularVelocity", "linearDamping", "angularDamping", "allowSleep",
+        "awake", "fixedRotation", "bullet", "active", "gravityScale")
+
+FIXTURE_DEF_ATTRS = ("friction", "restitution", "density", "isSensor",
+        "categoryBits", "maskBits", "groupIndex")
+
+JOINT_DEFS = {
+    "revolute": (b2.b2RevoluteJointDef, ("localAnchorA", "localAnchorB",
+        "referenceAngle", "enableLimit", "lowerAngle", "upperAngle",
+        "enableMotor", "motorSpeed", "maxMotorTorque")),
+    "distance": (b2.b2DistanceJointDef, ("localAnchorA", "localAnchorB",
+        "length", "frequencyHz", "dampingRatio")),
+    "prismatic": (b2.b2PrismaticJointDef, ("localAnchorA", "localAnchorB",
+        "localAxisA", "referenceAngle", "enableLimit", "lowerTranslation",
+        "upperTranslation", "enableMotor", "maxMotorForce", "motorSpeed")),
+    "wheel": (b2.b2WheelJointDef, ("localAnchorA", "localAnchorB",
+        "localAxisA", "enableMotor", "maxMotorTorque", "motorSpeed",
+        "frequencyHz", "dampingRatio")),
+    "rope": (b2.b2RopeJointDef, ("localAnchorA", "localAnchorB",
+        "maxLength")),
+    "motor": (b2.b2MotorJointDef, ("linearOffset", "angularOffset",
+        "maxForce", "maxTorque", "correctionFactor")),
+    "weld": (b2.b2WeldJointDef, ("localAnchorA", "localAnchorB",
+        "referenceAngle", "frequencyHz", "dampingRatio")),
+    "friction": (b2.b2FrictionJointDef, ("localAnchorA", "localAnchorB",
+        "maxForce", "maxTorque")),
+    }
+
+SHAPES = {
+    "circle": b2.b2CircleShape,
+    "polygon": b2.b2PolygonShape,
+    "edge": b2.b2EdgeShape,
+    "chain": b2.b2ChainShape,
+    "loop": b2.b2ChainShape,
+    }
+
+# in-process cache of compiled scenes keyed by (path, mtime)
+_scenes = dict()
+
+
+class Scene(object):
+    """ a json world resolved into plain definition parameters
+
+    All the json walking, renaming and defaulting is done once at compile 
+    time. Building a world from a scene only replays the resolved 
+    definitions into a fresh b2World. The scene only holds builtin 
+    values, so that it can be pickled to disk or to worker processes.
+
+    """
+
+    def __init__(self, world, bodies, joints):
+        """
+        :param world: keyword arguments of b2World
+        :type world: dict(string: variant)
+
+        :param bodies: name, body definition attributes and a list
+                       of (fixture definition attributes, shape) 
+                       for each body
+        :type bodies: list(tuple(string, dict, list))
+
+        :param joints: name, type, index of bodyA, index of bodyB and 
+                       joint definition attributes for each joint
+        :type joints: list(tuple(string, string, int, int, dict))
+
+        """
+        self.world = world
+        self.bodies = bodies
+        self.joints = joints
+        self._defs = None
+
+    def __getstate__(self):
+        return {"world": self.world, "bodies": self.bodies, 
+                "joints": self.joints}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._defs = None
+
+    def defs(self):
+        """ the Box2D definition objects of the scene, built once
+
+        Definitions are copied by Box2D at creation time, so the same 
+        objects can be reused for all the worlds built in this process.
+
+        :return: body definitions with their fixture definitions 
+                 and joint definitions
+        :rtype: tuple(list, list)
+
+        """
+        if self._defs is None:
+            body_defs = []
+            for name, attrs, fixtures in self.bodies:
+                bodyDef = b2.b2BodyDef()
+                for attr, value in attrs.items():
+                    setattr(bodyDef, attr, value)
+                fixtureDefs = []
+                for fixture_attrs, (shape_type, shape_args) in fixtures:
+                    fixtureDef = b2.b2FixtureDef()
+                    for attr, value in fixture_attrs.items():
+                        setattr(fixtureDef, attr, value)
+                    fixtureDef.shape = SHAPES[shape_type](**shape_args)
+                    # keep the shape alive together with its definition 
+                    fixtureDefs.append((fixtureDef, fixtureDef.shape))
+                body_defs.append((name, bodyDef, fixtureDefs))
+
+            joint_defs = []
+            for name, joint_type, bodyA, bodyB, attrs in self.joints:
+                jointDef = JOINT_DEFS[joint_type][0]()
+                for attr, value in attrs.items():
+                    setattr(jointDef, attr, value)
+                joint_defs.append((name, joint_type, bodyA, bodyB, jointDef))
+
+            self._defs = (body_defs, joint_defs)
+
+        return self._defs
+
+
+def loadScene(filePathName, cache_dir=None):
+    """ get the compiled scene of a json file
+
+    Scenes are cached in memory by path and modification time and 
+    optionally pickled into cache_dir, so that the json file is parsed
+    only once per version of the file.
+
+    :param filePathName: the name of the json file with parameters
+    :type filePathName: string
+
+    :param cache_dir: optional folder for the on-disk scene cache
+    :type cache_dir: string
+
+    :return: the compiled scene
+    :rtype: Scene
+
+    """
+    path = os.path.abspath(filePathName)
+    key = (path, os.path.getmtime(path))
+    if key in _scenes:
+        return _scenes[key]
+
+    scene = None
+    if cache_dir is not None:
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        cache_file = os.path.join(cache_dir, "scene_%s.pkl" % digest)
+        if os.path.exists(cache_file):
+            with open(cache_file, "rb") as pkl_file:
+                scene = pickle.load(pkl_file)
+
+    if scene is None:
+        with open(path, "r") as json_file:
+            scene = compileScene(json.load(json_file))
+        if cache_dir is not None:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_file = "%s.%d" % (cache_file, os.getpid())
+            with open(tmp_file, "wb") as pkl_file:
+                pickle.dump(scene, pkl_file)
+            os.replace(tmp_file, cache_file)
+
+    _scenes[key] = scene
+    return scene
+
+
+def compileScene(jsw):
+    """ resolve json data into a scene
+
+    The definitions are created through the same functions used to 
+    build worlds from json, then their attributes are read back.
+
+    :param jsw: dictionary defining all the gropups of data
+                in the json file 
+    :type jsw: dict(sting: variant)
+
+    :return: the compiled scene
+    :rtype: Scene
+
+    """
+    world = dict(
+        autoClearForces=jsw["autoClearForces"],
+        continuousPhysics=jsw["continuousPhysics"],
+        gravity=tuple(rubeVecToB2Vec2(jsw["gravity"])),
+        subStepping=jsw["subStepping"],
+        warmStarting=jsw["warmStarting"],
+        )
+
+    bodies = []
+    for jsw_body in jsw.get("body", []):
+        bodyDef = create_bodyDef(jsw, jsw_body)
+        fixtures = []
+        for jsw_fixture in jsw_body["fixture"]:
+            fixtureDef = create_fixtureDef(jsw, jsw_fixture)
+            fixtures.append((readAttrs(fixtureDef, FIXTURE_DEF_ATTRS),
+                readShape(fixtureDef.shape, jsw_fixture)))
+        bodies.append((jsw_body["name"], 
+            readAttrs(bodyDef, BODY_DEF_ATTRS), fixtures))
+
+    joints = []
+    if "joint" in jsw:
+        # joint definitions need the bodies of a world to be resolved
+        b2_world = create_world(jsw)
+        created = [add_body(b2_world, jsw, jsw_body)[1] 
+                for jsw_body in jsw.get("body", [])]
+        for jsw_joint in jsw["joint"]:
+            joint_type = jsw_joint["type"]
+            jointDef = create_jointDef(jsw_joint, b2_world)
+            bodyA = created.index(jointDef.bodyA)
+            bodyB = created.index(jointDef.bodyB)
+            attrs = readAttrs(jointDef, 
+                    ("collideConnected",) + JOINT_DEFS[joint_type][1])
+            joints.append((jsw_joint["name"], joint_type, 
+                bodyA, bodyB, attrs))
+
+    return Scene(world, bodies, joints)
+
+
+def createWorldFromScene(scene):
+    """ replays the definitions of a compiled scene into a new b2World
+
+    :param scene: a compiled scene
+    :type scene: Scene
+
+    :return: the world and two dictionaries for bodies and joints
+    :rtype: tuple(b2World, dict(string: b2Body), dict(string: b2Joint))
+
+    """
+    body_defs, joint_defs = scene.defs()
+
+    b2_world = b2.b2World(**scene.world)
+
+    body_refs = dict()
+    created = []
+    for name, bodyDef, fixtureDefs in body_defs:
+        body_ref = b2_world.CreateBody(bodyDef)
+        for fixtureDef, _ in fixtureDefs:
+            body_ref.CreateFixture(fixtureDef)
+        body_refs[name] = body_ref
+        created.append(body_ref)
+
+    joint_refs = dict()
+    for name, joint_type, bodyA, bodyB, jointDef in joint_defs:
+        jointDef.bodyA = created[bodyA]
+        jointDef.bodyB = created[bodyB]
+        joint_refs[name] = b2_world.CreateJoint(jointDef, joint_type)
+
+    return b2_world, body_refs, joint_refs
+
+
+def readAttrs(source_obj, attrs):
+    """ read back the attributes of a Box2D definition as builtin values
+
+    :param source_obj: a Box2D definition object
+    :type source_obj: variant
+
+    :param attrs: the names of the attributes to read
+    :type attrs: tuple(string)
+
+    :return: attribute name -> value, vectors as tuples
+    :rtype: dict(string: variant)
+
+    """
+    values = dict()
+    for attr in attrs:
+        value = getattr(source_obj, attr)
+        if isinstance(value, b2.b2Vec2):
+            value = tuple(value)
+        values[attr] = value
+    return values
+
+
+def readShape(shape, jsw_fixture):
+    """ read back a Box2D shape as a type and its constructor arguments
+
+    :param shape: the shape of a fixture definition
+    :type shape: b2Shape
+
+    :param jsw_fixture: the json fixture the shape was built from
+    :type jsw_fixture: dict(string: variant)
+
+    :return: shape type and keyword arguments
+    :rtype: tuple(string, dict(string: variant))
+
+    """
+    if isinstance(shape, b2.b2CircleShape):
+        return "circle", dict(pos=tuple(shape.pos), radius=shape.radius)
+    if isinstance(shape, b2.b2PolygonShape):
+        return "polygon", dict(vertices=[tuple(v) for v in shape.vertices])
+    if isinstance(shape, b2.b2EdgeShape):
+        return "edge", dict(vertices=[tuple(v) for v in shape.vertices])
+    if "hasNextVertex" in jsw_fixture["chain"]:
+        # loops are stored with the closing vertex
+        return "loop", dict(vertices_loop=[tuple(v) 
+            for v in shape.vertices[:-1]])
+    return "chain", dict(vertices_chain=[tuple(v) for v in shape.vertices])
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
 def add_joints(b2_world, jsw):
     """ add joints described in the json file
 
@@ -321,6 +635,29 @@ def add_body(b2_world, jsw, jsw_body):
     :rtype: tuple(string, b2Body)
     """
 
+    # create body
+    body_ref = b2_world.CreateBody(create_bodyDef(jsw, jsw_body))
+
+    for fixture in jsw_body["fixture"]:
+        add_fixture(body_ref, jsw, fixture)
+
+    return jsw_body['name'], body_ref
+
+
+def create_bodyDef(jsw, jsw_body):
+    """ create a b2BodyDef from the json parameters of the body
+
+    :param jsw: dictionary defining all the gropups of data
+                in the json file 
+    :type jsw: dict(sting: variant)
+
+    :param jsw_body: dictionary defining the parameters of the body 
+    :type jsw_body: dict(sting: variant)
+
+    :return: the body definition object
+    :rtype: b2BodyDef
+    """
+
     # create body definition
     bodyDef = b2.b2BodyDef()
 
@@ -341,13 +678,7 @@ def add_body(b2_world, jsw, jsw_body):
     setAttr(jsw_body, "type", bodyDef)
     setAttr(jsw_body, "awake", bodyDef)
 
-    # create body
-    body_ref = b2_world.CreateBody(bodyDef)
-
-    for fixture in jsw_body["fixture"]:
-        add_fixture(body_ref, jsw, fixture)
-
-    return jsw_body['name'], body_ref
+    return bodyDef
 
 def add_fixture( b2_world_body, jsw, jsw_fixture ):
     """ add a fixture to a body
@@ -362,6 +693,25 @@ def add_fixture( b2_world_body, jsw, jsw_fixture ):
     :param jsw_fixture: a fixture
     :type jsw_fixture: b2Fixture
 
+    """
+
+    # create fixture
+    b2_world_body.CreateFixture(create_fixtureDef(jsw, jsw_fixture))
+
+
+def create_fixtureDef(jsw, jsw_fixture):
+    """ create a b2FixtureDef from the json parameters of the fixture
+
+    :param jsw: dictionary defining all the gropups of data
+                in the json file 
+    :type jsw: dict(sting: variant)
+    
+    :param jsw_fixture: a fixture
+    :type jsw_fixture: b2Fixture
+
+    :return: the fixture definition object
+    :rtype: b2FixtureDef
+
     """
      
     # create and fill fixture definition
@@ -471,8 +821,7 @@ def add_fixture( b2_world_body, jsw, jsw_fixture ):
                 vertices=chain_vertices,
                 )
 
-    # create fixture
-    b2_world_body.CreateFixture(fixtureDef)
+    return fixtureDef
 
 def setAttr(
         source_dict, source_key, target_obj, target_attr=None):
@@ -1,3 +1,5 @@
+import numpy as np
+
 class PID(object) :
 
     def __init__(self, dt=0.01, Kp=8.0, Ki=0.0, Kd=0.09 ):
@@ -37,3 +39,113 @@ class PID(object) :
         return self.output
 
 
+
+
+class PIDBank(object) :
+    """ Many PID controllers stored in contiguous arrays
+
+    Setpoints, internals and gains of all controllers are numpy arrays of 
+    the same shape, e.g. (num_joints,) for a single world or 
+    (num_worlds, num_joints) for a batch, so that all outputs are 
+    computed in a single vectorized update.
+    """
+
+    def __init__(self, shape, dt=0.01, Kp=8.0, Ki=0.0, Kd=0.09, 
+            arrays=None):
+        """
+        Args:
+
+            shape (int or tuple): shape of the bank
+            dt (float): integration step
+            Kp, Ki, Kd (float or np.ndarray): gains, broadcastable to shape
+            arrays (dict): already allocated arrays to use as storage,
+                see view
+
+        """
+
+        self.dt = dt
+        if arrays is None:
+            arrays = {name: np.zeros(shape) for name in self.fields}
+            arrays["Kp"][...] = Kp
+            arrays["Ki"][...] = Ki
+            arrays["Kd"][...] = Kd
+        for name in self.fields:
+            setattr(self, name, arrays[name])
+        self.shape = self.output.shape
+        self._tmp = np.zeros(self.shape)
+        self._error = np.zeros(self.shape)
+
+    fields = ("setpoint", "integral", "previous_error", "derivative", 
+            "output", "Kp", "Ki", "Kd")
+
+    def view(self, index):
+        """ A bank sharing storage with a part of this one
+
+        Args:
+
+            index: a basic numpy index, e.g. the row of a world
+
+        Returns:
+
+            (PIDBank): a bank whose arrays are views of this bank arrays
+        """
+
+        return PIDBank(None, dt=self.dt, arrays={name: 
+            getattr(self, name)[index] for name in self.fields})
+
+    def reset(self, index=Ellipsis):
+
+        self.previous_error[index] = 0.0
+        self.integral[index] = 0.0
+        self.derivative[index] = 0.0
+        self.setpoint[index] = 0.0
+        self.output[index] = 0.0
+
+    def set_gains(self, index=Ellipsis, Kp=None, Ki=None, Kd=None):
+        """ Change the gains of some controllers
+
+        Args:
+
+            index: the controllers to change, defaults to all
+            Kp, Ki, Kd (float or np.ndarray): new gains, unchanged if None
+
+        """
+
+        if Kp is not None:
+            self.Kp[index] = Kp
+        if Ki is not None:
+            self.Ki[index] = Ki
+        if Kd is not None:
+            self.Kd[index] = Kd
+
+    def step(self, measured_value, setpoint=None):
+        """ Update all controllers
+
+        Args:
+
+            measured_value (np.ndarray): current values, same shape as the bank
+            setpoint (np.ndarray): optional new setpoints
+
+        Returns:
+
+            (np.ndarray): the outputs, updated in place
+        """
+        
+        if setpoint is not None:
+            self.setpoint[...] = setpoint
+
+        tmp = self._tmp
+        error = np.subtract(self.setpoint, measured_value, out=self._error)
+        np.multiply(error, self.dt, out=tmp)
+        self.integral += tmp
+        np.subtract(error, self.previous_error, out=self.derivative)
+        self.derivative /= self.dt
+        np.multiply(self.Kp, error, out=self.output)
+        np.multiply(self.Ki, self.integral, out=tmp)
+        self.output += tmp
+        np.multiply(self.Kd, self.derivative, out=tmp)
+        self.output += tmp
+        
+        self.previous_error[...] = error
+
+        return self.output
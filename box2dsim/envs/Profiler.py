@@ -0,0 +1,105 @@
+import sys
+import time
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+class Profiler(object):
+    """ Wall time and call counts of the phases of a simulation step
+
+    Code to be profiled marks the end of each phase with lap(name): the
+    time since the previous mark is added to that phase. Instrumented
+    objects hold a profiler attribute that is None when profiling is
+    disabled, so that the only cost left is a test against None.
+
+        profiler = Profiler(summary_interval=1000)
+        env.set_profiler(profiler)
+        ... run ...
+        profiler.stats
+
+    """
+
+    def __init__(self, summary_interval=None, stream=None):
+        """
+        Args:
+
+            summary_interval (int): if given, a summary is written
+                every summary_interval steps
+            stream (file): where summaries are written,
+                defaults to sys.stderr
+
+        """
+
+        self.clock = time.perf_counter
+        self.summary_interval = summary_interval
+        self.stream = stream
+        self.reset()
+
+    def reset(self):
+        """ Forget all measures
+        """
+
+        self.times = {}
+        self.counts = {}
+        self.steps = 0
+        self.last = self.clock()
+
+    def start(self):
+        """ Mark the beginning of a sequence of phases
+        """
+
+        self.last = self.clock()
+
+    def lap(self, phase):
+        """ Mark the end of a phase
+
+        Args:
+
+            phase (string): the name of the phase
+
+        """
+
+        now = self.clock()
+        self.times[phase] = self.times.get(phase, 0.0) + now - self.last
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+        self.last = now
+
+    def end_step(self):
+        """ Count a step and write the periodic summary
+        """
+
+        self.steps += 1
+        if self.summary_interval and self.steps % self.summary_interval == 0:
+            stream = sys.stderr if self.stream is None else self.stream
+            stream.write(self.summary())
+            stream.flush()
+
+    @property
+    def stats(self):
+        """ (dict): phase -> calls, total seconds, mean microseconds
+            per call and fraction of the total time
+        """
+
+        total = sum(self.times.values())
+        return {phase: {
+            "calls": self.counts[phase],
+            "total_s": seconds,
+            "mean_us": 1e6*seconds/self.counts[phase],
+            "fraction": seconds/total if total > 0 else 0.0}
+            for phase, seconds in self.times.items()}
+
+    def summary(self):
+        """ A table of the stats, slowest phases first
+
+        Returns:
+
+            (string): the summary
+        """
+
+        stats = self.stats
+        lines = ["%d steps" % self.steps]
+        lines += ["  %-16s %10d calls %10.3f s %10.2f us %6.1f%%" % (
+            phase, s["calls"], s["total_s"], s["mean_us"],
+            100*s["fraction"]) for phase, s in sorted(stats.items(),
+                key=lambda item: -item[1]["total_s"])]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,274 @@
+import numpy as np
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+def pad_polygons(polygons):
+    """ Stack polygons with different numbers of vertices
+
+    Shorter polygons are padded by repeating their last vertex, which
+    adds zero-length edges that never exclude a point.
+
+    Args:
+
+        polygons (list): a list of (n_i, 2) vertex arrays
+
+    Returns:
+
+        (np.ndarray): a (len(polygons), max(n_i), 2) array
+    """
+
+    num_vertices = max(len(p) for p in polygons)
+    padded = np.zeros([len(polygons), num_vertices, 2])
+    for i, p in enumerate(polygons):
+        p = np.asarray(p, dtype=float)
+        padded[i, :len(p)] = p
+        padded[i, len(p):] = p[-1]
+    return padded
+
+
+def edge_equations(polygons):
+    """ Normalized half-plane equations of the edges of convex polygons
+
+    Args:
+
+        polygons (np.ndarray): (..., V, 2) vertices of convex polygons,
+            in any orientation
+
+    Returns:
+
+        (np.ndarray, np.ndarray, np.ndarray): a, b, c of shape (..., V)
+            such that a*x + b*y + c is the signed distance of (x, y)
+            from each edge, positive inside the polygon
+    """
+
+    start = polygons
+    end = np.roll(polygons, -1, axis=-2)
+    edge = end - start
+    length = np.sqrt((edge**2).sum(-1))
+    length[length == 0] = 1
+    # signed area gives the orientation, interior is on the left of
+    # counter-clockwise edges
+    area = (start[..., 0]*end[..., 1] - end[..., 0]*start[..., 1]).sum(-1)
+    orientation = np.where(area < 0, -1.0, 1.0)[..., None]
+    a = -edge[..., 1]/length*orientation
+    b = edge[..., 0]/length*orientation
+    c = -(a*start[..., 0] + b*start[..., 1])
+    return a, b, c
+
+
+def downsample(samples):
+    """ Mean of the antialiasing samples of each pixel
+
+    Sums strided slices, which is much faster than a mean
+    over the two interleaved sample axes.
+
+    Args:
+
+        samples (np.ndarray): (..., h, aa, w, aa) samples
+
+    Returns:
+
+        (np.ndarray): the (..., h, w) pixel means
+    """
+
+    aa = samples.shape[-1]
+    out = samples[..., 0, :, 0].astype(float)
+    for i in range(aa):
+        for j in range(aa):
+            if i or j:
+                out += samples[..., i, :, j]
+    out /= aa*aa
+    return out
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+class PolygonRasterizer(object):
+    """ Scanline rasterizer of convex polygons on a regular pixel grid
+
+    A pixel is filled by a polygon when its center lies inside the polygon
+    grown by margin, i.e. when its signed distance from every edge is at
+    least -margin. For each row the edge half-planes give the interval of
+    filled columns analytically, so the cost grows with polygons x edges
+    x rows instead of with the number of pixels. All polygons of all images 
+    are processed in a single vectorized pass, after a bounding-box cull
+    of the polygons outside each field. Overlapping polygons sum up.
+    """
+
+    def __init__(self, size, rng, margin=0.0, antialiasing=1):
+        """
+        Args:
+
+            size (int, int): width, height of the image in pixels
+            rng (float, float): x and y range of the image in the task space
+            margin (float): distance by which polygons are grown
+            antialiasing (int): each pixel is the mean of
+                antialiasing x antialiasing samples
+
+        """
+
+        self.size = np.array(size, dtype=int)
+        self.scale = np.array(rng, dtype=float)/self.size
+        self.margin = margin
+        self.antialiasing = int(antialiasing)
+
+        aa = self.antialiasing
+        w, h = self.size
+        # sample centers relative to the focus, the same layout as
+        # VisualSensor: x grows along columns, y decreases along rows
+        x = np.arange(-w//2, w//2) + 1
+        y = np.arange(-h//2, h//2)[::-1] + 1
+        sub = (np.arange(aa) + 0.5)/aa - 0.5
+        self.x = ((x[:, None] + sub[None, :]).ravel())*self.scale[0]
+        self.y = ((y[:, None] - sub[None, :]).ravel())*self.scale[1]
+        self.dx = self.scale[0]/aa
+
+    def render(self, polygons, focus, out=None):
+        """ Rasterize convex polygons
+
+        Args:
+
+            polygons (np.ndarray): (P, V, 2) vertices in the task space
+            focus (float, float): x, y of the image center
+            out (np.ndarray): optional (height, width) output buffer
+
+        Returns:
+
+            (np.ndarray): the (height, width) image
+        """
+
+        w, h = self.size
+        if out is None:
+            out = np.zeros([h, w])
+        polygons = np.asarray(polygons, dtype=float)
+        self.render_batch(polygons[None], np.reshape(focus, [1, 1, 2]),
+                out=out.reshape(1, 1, h, w))
+        return out
+
+    def spans(self, polygons, foci):
+        """ Filled intervals of the sample rows of many scenes and foci
+
+        Args:
+
+            polygons (np.ndarray): (B, P, V, 2) vertices of B scenes
+            foci (np.ndarray): (B, K, 2) image centers for each scene
+
+        Returns:
+
+            (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+                image (b*K + k), polygon, sample row, first and last
+                (excluded) sample column of each nonempty interval,
+                sorted by image, polygon and row
+        """
+
+        hs, ws = self.size[::-1]*self.antialiasing
+        polygons = np.asarray(polygons, dtype=float)
+        foci = np.asarray(foci, dtype=float)
+        num_foci = foci.shape[1]
+        margin = self.margin
+
+        # bounding-box cull: keep the (scene, focus, polygon) 
+        # triples whose polygon may touch the field. Grown corners 
+        # reach up to 2*margin away from the vertices for polygons 
+        # whose angles are not sharper than 60 degrees
+        lo = polygons.min(2) - 2*margin
+        hi = polygons.max(2) + 2*margin
+        x0 = foci[..., 0] + self.x[0]
+        x1 = foci[..., 0] + self.x[-1]
+        y0 = foci[..., 1] + self.y[-1]
+        y1 = foci[..., 1] + self.y[0]
+        visible = (hi[:, None, :, 0] >= x0[..., None]) & \
+                (lo[:, None, :, 0] <= x1[..., None]) & \
+                (hi[:, None, :, 1] >= y0[..., None]) & \
+                (lo[:, None, :, 1] <= y1[..., None])
+        scene, focus, polygon = np.nonzero(visible)
+        if len(scene) == 0:
+            empty = np.zeros(0, dtype=int)
+            return empty, empty, empty, empty, empty
+
+        # only the rows spanned by the bounding box of each polygon
+        dy = self.scale[1]/self.antialiasing
+        top = foci[scene, focus, 1] + self.y[0]
+        row0 = np.ceil((top - hi[scene, polygon, 1])/dy - 1e-9)
+        row1 = np.floor((top - lo[scene, polygon, 1])/dy + 1e-9) + 1
+        row0 = np.clip(row0, 0, hs).astype(int)
+        row1 = np.clip(row1, 0, hs).astype(int)
+        rows = row0[:, None] + np.arange(max(1, (row1 - row0).max()))
+        in_range = rows < row1[:, None]
+        rows = np.minimum(rows, hs - 1)
+        ys = self.y[rows] + foci[scene, focus, 1, None]
+
+        a, b, c = edge_equations(polygons[scene, polygon])
+
+        # a*x >= rhs for each edge and row
+        rhs = b[:, :, None]*ys[:, None, :]
+        rhs += c[:, :, None]
+        rhs += margin
+        rhs *= -1
+        a = a[:, :, None]
+        eps = 1e-12
+        with np.errstate(divide="ignore", invalid="ignore"):
+            bound = rhs/a
+        lower = np.where(a > eps, bound, -np.inf).max(1)
+        upper = np.where(a < -eps, bound, np.inf).min(1)
+        feasible = np.where(np.abs(a) <= eps, rhs <= 0, True).all(1)
+
+        left = foci[scene, focus, 0, None] + self.x[0]
+        with np.errstate(invalid="ignore"):
+            first = np.ceil((lower - left)/self.dx)
+            last = np.floor((upper - left)/self.dx) + 1
+        first = np.clip(first, 0, ws)
+        last = np.clip(last, 0, ws)
+        filled = in_range & feasible & (first < last)
+
+        num_rows = rows.shape[1]
+        image = np.repeat(scene*num_foci + focus, num_rows)[filled.ravel()]
+        polygon = np.repeat(polygon, num_rows)[filled.ravel()]
+        return (image, polygon, rows[filled],
+                first[filled].astype(int), last[filled].astype(int))
+
+    def render_batch(self, polygons, foci, out=None):
+        """ Rasterize the polygons of many scenes, each seen from many foci
+
+        Args:
+
+            polygons (np.ndarray): (B, P, V, 2) vertices of B scenes
+            foci (np.ndarray): (B, K, 2) image centers for each scene
+            out (np.ndarray): optional (B, K, height, width) output buffer
+
+        Returns:
+
+            (np.ndarray): the (B, K, height, width) images
+        """
+
+        w, h = self.size
+        aa = self.antialiasing
+        ws, hs = w*aa, h*aa
+        num_scenes, num_foci = np.shape(foci)[:2]
+        if out is None:
+            out = np.zeros([num_scenes, num_foci, h, w])
+
+        image, _, rows, first, last = self.spans(polygons, foci)
+
+        # one row of ws + 1 counters per sample row of each image,
+        # filled intervals are added as +1/-1 at their ends
+        base = (image*hs + rows)*(ws + 1)
+        num_filled = len(base)
+        weights = np.ones(2*num_filled)
+        weights[num_filled:] = -1
+        counts = np.bincount(np.concatenate((base + first, base + last)),
+                weights, minlength=num_scenes*num_foci*hs*(ws + 1))
+        counts = counts.reshape(-1, ws + 1)[:, :ws]
+
+        if aa > 1:
+            samples = np.cumsum(counts, axis=1).reshape(
+                    num_scenes, num_foci, h, aa, w, aa)
+            out[:] = downsample(samples)
+        elif out.flags.c_contiguous:
+            np.cumsum(counts, axis=1, out=out.reshape(-1, ws))
+        else:
+            out[:] = np.cumsum(counts, axis=1).reshape(out.shape)
+
+        return out
+
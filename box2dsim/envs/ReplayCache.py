@@ -0,0 +1,275 @@
+import collections
+import hashlib
+import os
+import numpy as np
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+_digests = dict()
+
+def file_digest(filePathName):
+    """ The sha1 of the content of a file, computed once per version
+
+    Args:
+
+        filePathName (string): the file
+
+    Returns:
+
+        (string): the hex digest
+    """
+
+    path = os.path.abspath(filePathName)
+    key = (path, os.path.getmtime(path))
+    if key not in _digests:
+        with open(path, "rb") as f:
+            _digests[key] = hashlib.sha1(f.read()).hexdigest()
+    return _digests[key]
+
+
+def dynamics_settings(sim):
+    """ The parameters of a simulation that can be changed after
+    loading the world file and change its trajectories
+
+    Args:
+
+        sim (Box2DSim): the simulation
+
+    Returns:
+
+        (list): controller gains and step, gravity, touch sensor mode, 
+            body, fixture and joint parameters, as numbers
+    """
+
+    pids = sim.pids
+    settings = [pids.dt, sim.contact_sensors.intensity]
+    for gains in (pids.Kp, pids.Ki, pids.Kd):
+        settings.extend(np.ravel(gains).tolist())
+    settings.extend(sim.world.gravity)
+    for body in sim.body_list:
+        settings.extend((body.mass, body.inertia, body.linearDamping, 
+            body.angularDamping, body.gravityScale, body.fixedRotation))
+        for fixture in body.fixtures:
+            settings.extend((fixture.density, fixture.friction, 
+                fixture.restitution, fixture.sensor))
+    for joint in sim.joint_list:
+        settings.extend((joint.GetMaxMotorTorque(), joint.motorEnabled,
+            joint.limitEnabled, joint.lowerLimit, joint.upperLimit))
+    return [float(value) for value in settings]
+
+
+def observation_arrays(env):
+    """ Joint positions, touch sensors and object positions as arrays
+
+    They are read from the simulation, so they do not depend on the
+    observation mode and components of the env.
+
+    Args:
+
+        env (Box2DSimOneArmEnv): the env
+
+    Returns:
+
+        (np.ndarray, np.ndarray, np.ndarray): (num_joints,),
+            (num_objects, num_parts) and (num_objects, 2) arrays
+    """
+
+    sim = env.sim
+    joints = np.array([sim.joints[name].angle for name in env.joint_names])
+    sensors = env.touch_matrix()[np.ix_(env.parts_indices, 
+        env.object_indices)].T
+    obj_pos = np.array([sim.bodies[name].worldCenter 
+        for name in env.object_names])
+    return joints, sensors, obj_pos
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+class ReplayCache(object):
+    """ Cache of the observation trajectories of deterministic rollouts
+
+    A rollout resets an env, optionally seeded, and runs a sequence of
+    actions. Since the simulation is deterministic, its trajectory only
+    depends on the content of the world file, the seed (when objects have
+    random initial poses), the env and simulation settings that change 
+    the dynamics (see dynamics_settings) and the actions, which are 
+    hashed into the key. Trajectories are kept in
+    memory with LRU eviction and, if cache_dir is given, written to disk
+    where they outlive the process and the memory tier.
+
+        cache = ReplayCache(cache_dir="replays")
+        trajectory = cache.rollout(env, actions, seed=1)
+        trajectory["JOINT_POSITIONS"]   # (len(actions), 7)
+
+    """
+
+    keys = ["JOINT_POSITIONS", "TOUCH_SENSORS", "OBJ_POSITION"]
+
+    def __init__(self, max_items=256, cache_dir=None):
+        """
+        Args:
+
+            max_items (int): number of trajectories kept in memory
+            cache_dir (string): optional folder of the on-disk tier
+
+        """
+
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        self.items = collections.OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, env, actions, seed=None):
+        """ The key of a rollout
+
+        Args:
+
+            env (Box2DSimOneArmEnv): the env
+            actions (np.ndarray): a (T, 5) sequence of actions
+            seed (int): the seed given to env.seed before reset
+
+        Returns:
+
+            (string): the hex digest identifying the trajectory
+        """
+
+        init_range = env.object_init_range
+        if init_range is None:
+            # the seed changes nothing
+            seed = None
+        else:
+            init_range = np.asarray(init_range, dtype=float).tolist()
+        settings = (seed, init_range, env.action_repeat,
+                env.accumulate_touches, env.sim.dt, env.sim.vel_iters,
+                env.sim.pos_iters, dynamics_settings(env.sim))
+        actions = np.ascontiguousarray(actions, dtype=float)
+
+        digest = hashlib.sha1(file_digest(env.world_file).encode())
+        digest.update(repr(settings).encode())
+        digest.update(repr(actions.shape).encode())
+        digest.update(actions.tobytes())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, "replay_%s.npz" % key)
+
+    def get(self, key):
+        """ Look up a trajectory, from memory first then from disk
+
+        Args:
+
+            key (string): a key returned by self.key
+
+        Returns:
+
+            (dict): the trajectory or None
+        """
+
+        if key in self.items:
+            self.items.move_to_end(key)
+            self.hits += 1
+            return self.items[key]
+
+        if self.cache_dir is not None and os.path.exists(self._path(key)):
+            with np.load(self._path(key)) as archive:
+                trajectory = {name: archive[name] for name in self.keys}
+            self.disk_hits += 1
+            self._remember(key, trajectory)
+            return trajectory
+
+        self.misses += 1
+        return None
+
+    def put(self, key, trajectory):
+        """ Store a trajectory
+
+        Args:
+
+            key (string): a key returned by self.key
+            trajectory (dict): arrays of the observations, see rollout
+
+        """
+
+        self._remember(key, trajectory)
+        if self.cache_dir is not None:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            path = self._path(key)
+            tmp_file = "%s.%d" % (path, os.getpid())
+            with open(tmp_file, "wb") as f:
+                np.savez(f, **trajectory)
+            os.replace(tmp_file, path)
+
+    def _remember(self, key, trajectory):
+        # cached arrays are shared by all the callers
+        for array in trajectory.values():
+            array.flags.writeable = False
+        self.items[key] = trajectory
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+    def clear(self, disk=False):
+        """ Empty the memory tier and optionally the disk tier
+        """
+
+        self.items.clear()
+        if disk and self.cache_dir is not None and \
+                os.path.exists(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.startswith("replay_") and name.endswith(".npz"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def __len__(self):
+        return len(self.items)
+
+    def rollout(self, env, actions, seed=None):
+        """ The observations of a rollout, simulated only if not cached
+
+        When the trajectory is served from the cache the env is not
+        touched, otherwise it is left at the end of the rollout.
+        Rollouts with random initial poses and no seed are not
+        deterministic and are always simulated and never cached.
+
+        Args:
+
+            env (Box2DSimOneArmEnv): the env
+            actions (np.ndarray): a (T, 5) sequence of actions
+            seed (int): if given, env.seed(seed) is called before reset
+
+        Returns:
+
+            (dict): (T, num_joints) JOINT_POSITIONS, (T, num_objects,
+                num_parts) TOUCH_SENSORS and (T, num_objects, 2)
+                OBJ_POSITION after each action. Cached arrays are
+                read-only.
+        """
+
+        deterministic = seed is not None or env.object_init_range is None
+        if deterministic:
+            key = self.key(env, actions, seed)
+            trajectory = self.get(key)
+            if trajectory is not None:
+                return trajectory
+
+        if seed is not None:
+            env.seed(seed)
+        env.reset()
+        trajectory = None
+        for t, action in enumerate(actions):
+            env.step(action)
+            arrays = observation_arrays(env)
+            if trajectory is None:
+                trajectory = {name: np.zeros((len(actions),) +
+                    np.shape(array)) for name, array in zip(self.keys, arrays)}
+            for name, array in zip(self.keys, arrays):
+                trajectory[name][t] = array
+        if trajectory is None:
+            trajectory = {name: np.zeros([0]) for name in self.keys}
+
+        if deterministic:
+            self.put(key, trajectory)
+        return trajectory
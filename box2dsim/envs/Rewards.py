@@ -0,0 +1,193 @@
+import copy
+import numpy as np
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+class Term(object):
+    """ A reward or termination term of a batch of worlds
+
+    A term is called with the stacked observation dictionary of a
+    VecBox2DSim and returns one value per world, computed with array
+    operations over the whole batch. Terms that need more than the
+    observation read it from the env they are bound to: set_reward_fun
+    and set_done_fun call bind(env), which returns a bound copy, so
+    that unbound terms can be pickled and sent to the workers of a
+    SubprocVecBox2DSim.
+    """
+
+    def bind(self, env):
+        """ A copy of the term bound to an env
+
+        Args:
+
+            env (VecBox2DSim): the env whose observations are given
+                to the term
+
+        Returns:
+
+            (Term): the bound term
+        """
+
+        return copy.copy(self)
+
+    def __call__(self, observation):
+        raise NotImplementedError
+
+
+def bind(fun, env):
+    """ Bind a term to an env, plain functions are returned as they are
+    """
+
+    if isinstance(fun, Term):
+        return fun.bind(env)
+    return fun
+
+
+class Sum(Term):
+    """ Weighted sum of terms
+    """
+
+    def __init__(self, terms, weights=None):
+        """
+        Args:
+
+            terms (list): the terms
+            weights (list): a weight per term, defaults to ones
+
+        """
+
+        self.terms = list(terms)
+        if weights is None:
+            weights = np.ones(len(self.terms))
+        self.weights = list(weights)
+
+    def bind(self, env):
+        bound = copy.copy(self)
+        bound.terms = [bind(term, env) for term in self.terms]
+        return bound
+
+    def __call__(self, observation):
+        total = 0.0
+        for weight, term in zip(self.weights, self.terms):
+            total = total + weight*np.asarray(term(observation), dtype=float)
+        return total
+
+
+class AnyOf(Term):
+    """ True where any of the terms is true, to combine termination terms
+    """
+
+    def __init__(self, terms):
+        """
+        Args:
+
+            terms (list): the boolean terms
+
+        """
+
+        self.terms = list(terms)
+
+    def bind(self, env):
+        bound = copy.copy(self)
+        bound.terms = [bind(term, env) for term in self.terms]
+        return bound
+
+    def __call__(self, observation):
+        done = np.zeros(len(observation["JOINT_POSITIONS"]), dtype=bool)
+        for term in self.terms:
+            done |= np.asarray(term(observation), dtype=bool)
+        return done
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+class TouchCount(Term):
+    """ The number of contacts between the robot parts and the objects
+    """
+
+    def __call__(self, observation):
+        return observation["TOUCH_SENSORS"].sum(axis=(1, 2))
+
+
+class GripperObjectDistance(Term):
+    """ Distance between the gripper and an object
+
+    The gripper is the mean of the centers of mass of a set of robot
+    parts, by default the distal phalanges of the two fingers. Use a
+    negative weight to reward getting close.
+    """
+
+    def __init__(self, parts=("claw12", "claw22"), object_index=0):
+        """
+        Args:
+
+            parts (list): the names of the robot parts whose centers are
+                averaged into the gripper position
+            object_index (int): the object, in the order of object_names
+
+        """
+
+        self.parts = list(parts)
+        self.object_index = object_index
+
+    def bind(self, env):
+        bound = copy.copy(self)
+        bound.bodies = [[sim.bodies[name] for name in self.parts]
+                for sim in env.sims]
+        bound.positions = np.zeros([env.num_envs, len(self.parts), 2])
+        return bound
+
+    def __call__(self, observation):
+        positions = self.positions
+        for bodies, out in zip(self.bodies, positions):
+            out[:] = [body.worldCenter for body in bodies]
+        gripper = positions.mean(1)
+        obj = observation["OBJ_POSITION"][:, self.object_index]
+        return np.sqrt(((gripper - obj)**2).sum(-1))
+
+
+class ObjectDisplacement(Term):
+    """ Distance of the objects from their positions at the last reset,
+    summed over the objects
+    """
+
+    def bind(self, env):
+        bound = copy.copy(self)
+        # updated in place by env.reset
+        bound.initial_positions = env.initial_obj_positions
+        return bound
+
+    def __call__(self, observation):
+        shift = observation["OBJ_POSITION"] - self.initial_positions
+        return np.sqrt((shift**2).sum(-1)).sum(-1)
+
+
+class ObjectOutOfBounds(Term):
+    """ True where any object left a rectangle of the task space
+    """
+
+    def __init__(self, xlim=None, ylim=None):
+        """
+        Args:
+
+            xlim (float, float): x range, defaults to env.taskspace_xlim
+            ylim (float, float): y range, defaults to env.taskspace_ylim
+
+        """
+
+        self.xlim = xlim
+        self.ylim = ylim
+
+    def bind(self, env):
+        bound = copy.copy(self)
+        xlim = env.taskspace_xlim if self.xlim is None else self.xlim
+        ylim = env.taskspace_ylim if self.ylim is None else self.ylim
+        bound.low = np.array([xlim[0], ylim[0]], dtype=float)
+        bound.high = np.array([xlim[1], ylim[1]], dtype=float)
+        return bound
+
+    def __call__(self, observation):
+        positions = observation["OBJ_POSITION"]
+        outside = (positions < self.low) | (positions > self.high)
+        return outside.any(axis=(1, 2))
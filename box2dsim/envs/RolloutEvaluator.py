@@ -0,0 +1,281 @@
+import time
+import traceback
+import numpy as np
+import multiprocessing as mp
+from .VecBox2DSim_env import VecBox2DSim
+from .SubprocVecBox2DSim_env import SharedBuffers, WorkerError, \
+        receive, send
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+def _worker(remote, parent_remote, world_file, dt, action_repeat, 
+        start, stop, buffers):
+    """ Evaluate a shard of the candidates in a subprocess
+
+    Args:
+
+        remote (Connection): the worker end of the command pipe
+        parent_remote (Connection): the parent end, closed in the worker
+        world_file (string): the json file from which worlds are created
+        dt (float): the simulation step
+        action_repeat (int): simulation steps run with each action
+        start, stop (int): the candidates owned by this worker
+        buffers (SharedBuffers): the shared state, candidates, costs
+            and final states
+
+    """
+
+    parent_remote.close()
+    venv = VecBox2DSim(stop - start, world_file, dt=dt)
+    venv.action_repeat = action_repeat
+    state = buffers["state"]
+    candidates = buffers["candidates"][start:stop]
+    costs = buffers["costs"][start:stop]
+    final_states = buffers["final_states"][start:stop]
+    alive = np.ones(stop - start, dtype=bool)
+
+    def execute(cmd, data):
+        if cmd == "evaluate":
+            horizon, return_states = data
+            venv.set_state(state)
+            # rewards relative to the start of the episode
+            # are relative to the evaluated state
+            venv.initial_obj_positions[:] = venv.obj_positions
+            costs[:] = 0
+            alive[:] = True
+            for h in range(horizon):
+                _, rewards, dones, _ = venv.step(candidates[:, h])
+                costs[:] -= np.where(alive, rewards, 0)
+                alive[:] &= ~dones
+            if return_states:
+                venv.get_state(final_states)
+        elif cmd == "set_reward_fun":
+            venv.set_reward_fun(data)
+        elif cmd == "set_done_fun":
+            venv.set_done_fun(data)
+        elif cmd == "close":
+            venv.close()
+        else:
+            raise NotImplementedError("unknown command %s" % cmd)
+
+    # the same protocol as the SubprocVecBox2DSim workers
+    try:
+        while True:
+            cmd = None
+            try:
+                cmd, data = remote.recv()
+                reply = execute(cmd, data)
+            except EOFError:
+                break
+            except Exception:
+                reply = WorkerError(traceback.format_exc())
+            remote.send(reply)
+            if cmd == "close":
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        remote.close()
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+class RolloutEvaluator(object):
+    """ Evaluate candidate action sequences from a state, in parallel
+
+    Meant for sampling-based model-predictive control (CEM, MPPI): at
+    each control tick the M candidate sequences of H actions are
+    simulated from the current state of an env, and the cost of each
+    candidate is minus the sum of its rewards up to the end of the
+    horizon or to the step where it is done, so rewards must be 
+    higher for better candidates.
+
+    The candidates are split across worker processes, each owning a
+    VecBox2DSim of its share of the worlds, built once. A tick costs
+    about H x action_repeat x ceil(M/num_workers) world steps plus one
+    set_state per world, so its latency is sized by the number of
+    workers (up to the number of cpus). States, candidates, costs and final states
+    are exchanged through shared memory.
+
+        evaluator = RolloutEvaluator.from_env(env, num_candidates=256, 
+                horizon=20, num_workers=8)
+        # reward getting close to the object
+        evaluator.set_reward_fun(Rewards.Sum(
+            [Rewards.GripperObjectDistance()], weights=[-1]))
+        costs = evaluator.evaluate(env.get_state(), candidates)
+        env.step(candidates[np.argmin(costs), 0])
+
+    """
+
+    def __init__(self, num_candidates, horizon, world_file=None,
+            dt=1/80.0, action_repeat=1, num_workers=None, 
+            start_method=None):
+        """
+        Args:
+
+            num_candidates (int): number M of candidates of each call
+            horizon (int): maximum number H of actions of a candidate
+            world_file (string): the json file from which all worlds are
+                created. Defaults to the one-arm scenario.
+            dt (float): the simulation step, the same as the one of
+                the env whose states are evaluated
+            action_repeat (int): simulation steps run with each action, 
+                the same as the action_repeat of the env
+            num_workers (int): number of worker processes.
+                Defaults to the number of cpus.
+            start_method (string): multiprocessing start method
+
+        """
+
+        # a throw-away batch of one world gives the sizes
+        template = VecBox2DSim(1, world_file, dt=dt)
+        self.world_file = template.world_file
+        self.num_candidates = num_candidates
+        self.horizon = horizon
+        self.action_repeat = action_repeat
+        self.state_size = template.sims[0].state_size
+        num_actions = template.num_joints
+
+        if num_workers is None:
+            num_workers = mp.cpu_count()
+        num_workers = max(1, min(num_workers, num_candidates))
+        self.num_workers = num_workers
+
+        specs = {
+            "state": ((self.state_size,), np.float64),
+            "candidates": ((num_candidates, horizon, num_actions),
+                np.float64),
+            "costs": ((num_candidates,), np.float64),
+            "final_states": ((num_candidates, self.state_size), np.float64),
+            }
+        self.buffers = SharedBuffers(specs)
+
+        ctx = mp.get_context(start_method)
+        bounds = np.linspace(0, num_candidates, num_workers + 1).astype(int)
+        self.bounds = bounds
+        self.remotes, self.work_remotes = zip(
+                *[ctx.Pipe() for _ in range(num_workers)])
+        self.processes = []
+        for work_remote, remote, start, stop in zip(self.work_remotes,
+                self.remotes, bounds[:-1], bounds[1:]):
+            args = (work_remote, remote, self.world_file, dt, action_repeat,
+                    start, stop, self.buffers)
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        # wall time of the last call of evaluate, in seconds
+        self.latency = None
+        self.closed = False
+
+    @classmethod
+    def from_env(cls, env, num_candidates, horizon, num_workers=None,
+            start_method=None):
+        """ An evaluator with the world file, step and action repeat
+        of an env
+
+        Args:
+
+            env (Box2DSimOneArmEnv): the env whose states are evaluated
+            num_candidates (int): number M of candidates of each call
+            horizon (int): maximum number H of actions of a candidate
+            num_workers (int): number of worker processes
+            start_method (string): multiprocessing start method
+
+        Returns:
+
+            (RolloutEvaluator): the evaluator
+        """
+
+        if env.accumulate_touches:
+            raise ValueError("accumulate_touches is not supported")
+        return cls(num_candidates, horizon, world_file=env.world_file,
+                dt=env.sim.dt, action_repeat=env.action_repeat,
+                num_workers=num_workers, start_method=start_method)
+
+    def _call(self, cmd, data=None):
+        for remote in self.remotes:
+            send(remote, (cmd, data))
+        return receive(self.remotes)
+
+    def set_reward_fun(self, rew_fun=None):
+        """ Set the reward function of all workers
+
+        Args:
+
+            rew_fun (callable): a picklable function taking the stacked
+                observation dictionary of a shard and returning a
+                vector of rewards, see VecBox2DSim.set_reward_fun
+
+        """
+
+        self._call("set_reward_fun", rew_fun)
+
+    def set_done_fun(self, done_fun=None):
+        """ Set the termination function of all workers
+
+        Args:
+
+            done_fun (callable): a picklable function taking the stacked
+                observation dictionary of a shard and returning a
+                boolean vector, see VecBox2DSim.set_done_fun
+
+        """
+
+        self._call("set_done_fun", done_fun)
+
+    def evaluate(self, state, candidates, return_states=False):
+        """ Simulate the candidates from a state
+
+        Args:
+
+            state (np.ndarray): the starting state, see
+                Box2DSimOneArmEnv.get_state
+            candidates (np.ndarray): a (num_candidates, H, 5) array of
+                action sequences, with H up to horizon
+            return_states (bool): also return the final states
+
+        Returns:
+
+            (np.ndarray): the (num_candidates,) costs, and if
+                return_states the (num_candidates, state_size) final
+                states. Arrays are views over the shared buffers and
+                are overwritten by the next call.
+        """
+
+        start = time.perf_counter()
+        candidates = np.asarray(candidates)
+        num_candidates, horizon = candidates.shape[:2]
+        if num_candidates != self.num_candidates or horizon > self.horizon:
+            raise ValueError("candidates of shape %s, expected (%d, <= %d, "
+                    "5)" % (candidates.shape, self.num_candidates,
+                        self.horizon))
+        self.buffers["state"][:] = state
+        self.buffers["candidates"][:, :horizon] = candidates
+        self._call("evaluate", (horizon, return_states))
+        self.latency = time.perf_counter() - start
+
+        if return_states:
+            return self.buffers["costs"], self.buffers["final_states"]
+        return self.buffers["costs"]
+
+    def close(self):
+
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._call("close")
+        except (RuntimeError, OSError):
+            # workers that died cannot be closed, they are terminated
+            pass
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+    def __del__(self):
+        if not getattr(self, "closed", True):
+            self.close()
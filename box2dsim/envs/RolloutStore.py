@@ -0,0 +1,314 @@
+import json
+import os
+import numpy as np
+from .Simulator import VisualSensor
+from .ReplayCache import observation_arrays
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+class RolloutWriter(object):
+    """ Append transitions into a chunked columnar store
+
+    A store is a folder holding meta.json and one .npy file per column
+    and chunk (chunk_000000/actions.npy, ...). Rows are buffered in
+    preallocated arrays and each full chunk is written once, column by
+    column, then listed in meta.json. Readers only see complete chunks
+    and can memory-map every file.
+
+        writer = RolloutWriter.from_env(env, "rollouts/run0")
+        env.set_rollout_writer(writer)
+        ... env.reset(), env.step(action) ...
+        env.close()
+
+    """
+
+    def __init__(self, path, columns, chunk_size=4096):
+        """
+        Args:
+
+            path (string): the folder of the store, created if needed
+            columns (dict): name -> (shape, dtype) of a row of each column
+            chunk_size (int): number of rows of each chunk
+
+        """
+
+        self.path = path
+        self.chunk_size = chunk_size
+        self.columns = {name: (tuple(shape), np.dtype(dtype).str)
+                for name, (shape, dtype) in columns.items()}
+        self.buffers = {name: np.zeros((chunk_size,) + shape, dtype=dtype)
+                for name, (shape, dtype) in self.columns.items()}
+        self.chunks = []
+        self.num_rows = 0
+        self.closed = False
+
+        # extra row sources, see from_env
+        self.visual_sensor = None
+        self.focus = None
+        self.episode = -1
+        self.step = 0
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._write_meta()
+
+    @classmethod
+    def from_env(cls, env, path, chunk_size=4096, retina_size=None,
+            retina_range=(40, 40), focus=(10, 10)):
+        """ A writer of the transitions of a Box2DSimOneArmEnv
+
+        Columns are episode, step, actions, joint_positions,
+        touch_sensors, obj_positions, rewards and dones, plus retinae
+        if retina_size is given.
+
+        Args:
+
+            env (Box2DSimOneArmEnv): the env
+            path (string): the folder of the store
+            chunk_size (int): number of rows of each chunk
+            retina_size (int, int): if given, a (height, width) float32
+                retina is stored at each step
+            retina_range (float, float): retina range in the task space
+            focus (float, float): retina center in the task space
+
+        Returns:
+
+            (RolloutWriter): the writer
+        """
+
+        num_parts = len(env.robot_parts_names)
+        num_objects = len(env.object_names)
+        columns = {
+            "episode": ((), np.int64),
+            "step": ((), np.int64),
+            "actions": (env.action_space.shape, np.float64),
+            "joint_positions": ((len(env.joint_names),), np.float64),
+            "touch_sensors": ((num_objects, num_parts), np.float32),
+            "obj_positions": ((num_objects, 2), np.float64),
+            "rewards": ((), np.float64),
+            "dones": ((), np.bool_)}
+        if retina_size is not None:
+            columns["retinae"] = (tuple(retina_size[::-1]), np.float32)
+        writer = cls(path, columns, chunk_size)
+        if retina_size is not None:
+            writer.visual_sensor = VisualSensor(env.sim, retina_size,
+                    retina_range)
+            writer.focus = focus
+        return writer
+
+    def _write_meta(self):
+        meta = {
+            "chunk_size": self.chunk_size,
+            "columns": {name: {"shape": list(shape), "dtype": dtype}
+                for name, (shape, dtype) in self.columns.items()},
+            "chunks": self.chunks}
+        meta_file = os.path.join(self.path, "meta.json")
+        tmp_file = "%s.%d" % (meta_file, os.getpid())
+        with open(tmp_file, "w") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(tmp_file, meta_file)
+
+    def append(self, **row):
+        """ Append a row
+
+        Args:
+
+            row: a value for each column
+
+        """
+
+        index = self.num_rows % self.chunk_size
+        for name, value in row.items():
+            self.buffers[name][index] = value
+        self.num_rows += 1
+        if index + 1 == self.chunk_size:
+            self.flush()
+
+    def new_episode(self):
+        """ Start a new episode, called by env.reset
+        """
+
+        self.episode += 1
+        self.step = 0
+
+    def record(self, env, action, observation, reward, done):
+        """ Append the transition of an env step, called by env.step
+        """
+
+        if self.episode < 0:
+            self.new_episode()
+        joints, sensors, obj_pos = observation_arrays(env)
+        index = self.num_rows % self.chunk_size
+        if self.visual_sensor is not None:
+            self.visual_sensor.step(self.focus)
+            self.buffers["retinae"][index] = self.visual_sensor.retina
+        self.append(episode=self.episode, step=self.step, actions=action,
+                joint_positions=joints, touch_sensors=sensors,
+                obj_positions=obj_pos, rewards=reward, dones=done)
+        self.step += 1
+
+    def flush(self):
+        """ Write the buffered rows as a chunk
+        """
+
+        length = self.num_rows - self.chunk_size*len(self.chunks)
+        if length == 0:
+            return
+        name = "chunk_%06d" % len(self.chunks)
+        folder = os.path.join(self.path, name)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        for column, buffer in self.buffers.items():
+            np.save(os.path.join(folder, column + ".npy"), buffer[:length])
+        self.chunks.append({"name": name, "length": length})
+        self._write_meta()
+
+    def close(self):
+        """ Write the last, possibly partial, chunk
+        """
+
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+class RolloutReader(object):
+    """ Memory-mapped access to a store written by RolloutWriter
+
+    Chunks are memory-mapped when first accessed, so that only the
+    rows that are read are loaded from disk.
+
+        reader = RolloutReader("rollouts/run0")
+        for batch in reader.batches(256, shuffle=True):
+            batch["actions"]    # (256, 5)
+
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+
+            path (string): the folder of the store
+
+        """
+
+        self.path = path
+        self.refresh()
+
+    def refresh(self):
+        """ Read meta.json again, to see the chunks written since
+        """
+
+        with open(os.path.join(self.path, "meta.json")) as f:
+            meta = json.load(f)
+        self.columns = {name: (tuple(c["shape"]), np.dtype(c["dtype"]))
+                for name, c in meta["columns"].items()}
+        self.chunks = meta["chunks"]
+        lengths = [chunk["length"] for chunk in self.chunks]
+        self.offsets = np.concatenate(([0], np.cumsum(lengths))).astype(int)
+        if not hasattr(self, "maps"):
+            self.maps = {}
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def chunk(self, index, column):
+        """ The memory-mapped array of a column in a chunk
+        """
+
+        key = (index, column)
+        if key not in self.maps:
+            self.maps[key] = np.load(os.path.join(self.path,
+                self.chunks[index]["name"], column + ".npy"), mmap_mode="r")
+        return self.maps[key]
+
+    def read(self, start, stop, columns=None):
+        """ A contiguous range of rows
+
+        Args:
+
+            start, stop (int): the rows
+            columns (list): the columns to read, defaults to all
+
+        Returns:
+
+            (dict): name -> (stop - start, ...) array
+        """
+
+        if columns is None:
+            columns = list(self.columns)
+        stop = min(stop, len(self))
+        if start >= stop:
+            return self.gather([], columns)
+        first = np.searchsorted(self.offsets, start, side="right") - 1
+        last = np.searchsorted(self.offsets, stop, side="left")
+        batch = {}
+        for column in columns:
+            parts = []
+            for c in range(first, last):
+                lo = max(start, self.offsets[c]) - self.offsets[c]
+                hi = min(stop, self.offsets[c + 1]) - self.offsets[c]
+                parts.append(self.chunk(c, column)[lo:hi])
+            batch[column] = np.concatenate(parts) if len(parts) > 1 \
+                    else np.array(parts[0])
+        return batch
+
+    def gather(self, indices, columns=None):
+        """ Rows at arbitrary indices
+
+        Args:
+
+            indices (np.ndarray): the rows
+            columns (list): the columns to read, defaults to all
+
+        Returns:
+
+            (dict): name -> (len(indices), ...) array
+        """
+
+        if columns is None:
+            columns = list(self.columns)
+        indices = np.asarray(indices, dtype=int)
+        chunk = np.searchsorted(self.offsets, indices, side="right") - 1
+        rows = indices - self.offsets[chunk]
+        batch = {}
+        for column in columns:
+            shape, dtype = self.columns[column]
+            out = np.zeros((len(indices),) + shape, dtype=dtype)
+            for c in np.unique(chunk):
+                selected = chunk == c
+                out[selected] = self.chunk(c, column)[rows[selected]]
+            batch[column] = out
+        return batch
+
+    def batches(self, batch_size, columns=None, shuffle=False, rng=None):
+        """ Iterate over the whole store
+
+        Args:
+
+            batch_size (int): rows per batch, the last batch may be shorter
+            columns (list): the columns to read, defaults to all
+            shuffle (bool): visit the rows in random order
+            rng (np.random.RandomState): the generator used to shuffle
+
+        Yields:
+
+            (dict): name -> (batch_size, ...) array
+        """
+
+        if not shuffle:
+            for start in range(0, len(self), batch_size):
+                yield self.read(start, start + batch_size, columns)
+            return
+
+        if rng is None:
+            rng = np.random.RandomState()
+        order = rng.permutation(len(self))
+        for start in range(0, len(self), batch_size):
+            # sorted rows read the memory maps front to back
+            yield self.gather(np.sort(order[start:start + batch_size]),
+                    columns)
@@ -1,15 +1,107 @@
 from . import JsonToPyBox2D as json2d
-from .PID import PID
+from .PID import PIDBank
+from .Rasterizer import PolygonRasterizer, pad_polygons
+import numpy as np
+import Box2D as b2
 import time, sys, os, glob 
 
 #------------------------------------------------------------------------------ 
 #------------------------------------------------------------------------------ 
 
+class ContactSensors(b2.b2ContactListener):
+    """ Touch matrix between bodies kept up to date by Box2D callbacks
+
+    touches[i, j] is the number of touching contacts between bodies i and j
+    (symmetric). It is updated incrementally when contacts begin and end,
+    so reading it costs nothing more than indexing an array. 
+    peak_touches[i, j] is the largest value touches[i, j] reached since
+    the last call to clear_peaks, so that contacts beginning and ending 
+    between two readings are not lost. If requested, impulses[i, j] 
+    accumulates the normal impulses solved between bodies i and j during 
+    the last step.
+    """
+
+    def __init__(self, bodies, intensity=False):
+        """
+        Args:
+
+            bodies (dict): name -> b2Body of the bodies to monitor
+            intensity (bool): accumulate normal impulses in PostSolve
+
+        """
+
+        b2.b2ContactListener.__init__(self)
+        self.body_index = {body: i for i, body in enumerate(bodies.values())}
+        n = len(self.body_index)
+        self.touches = np.zeros([n, n])
+        self.peak_touches = np.zeros([n, n])
+        self.impulses = np.zeros([n, n])
+        self.intensity = intensity
+
+    def _pair(self, contact):
+        return (self.body_index[contact.fixtureA.body], 
+                self.body_index[contact.fixtureB.body])
+
+    def clear_peaks(self):
+        """ Start a new period of peak_touches from the current touches
+        """
+        self.peak_touches[:] = self.touches
+
+    def BeginContact(self, contact):
+        a, b = self._pair(contact)
+        self.touches[a, b] += 1
+        self.touches[b, a] += 1
+        if self.touches[a, b] > self.peak_touches[a, b]:
+            self.peak_touches[a, b] = self.peak_touches[b, a] = \
+                    self.touches[a, b]
+
+    def EndContact(self, contact):
+        a, b = self._pair(contact)
+        self.touches[a, b] -= 1
+        self.touches[b, a] -= 1
+
+    def PreSolve(self, contact, old_manifold):
+        pass
+
+    def PostSolve(self, contact, impulse):
+        if self.intensity:
+            a, b = self._pair(contact)
+            intensity = sum(impulse.normalImpulses)
+            self.impulses[a, b] += intensity
+            self.impulses[b, a] += intensity
+
+#------------------------------------------------------------------------------ 
+#------------------------------------------------------------------------------ 
+
+def transform_vertices(local_vertices, poses):
+    """ Move body-local vertices to world coordinates
+
+    Args:
+
+        local_vertices (np.ndarray): (..., P, V, 2) body-local vertices
+        poses (np.ndarray): (..., P, 3) x, y and angle of each body
+
+    Returns:
+
+        (np.ndarray): (..., P, V, 2) world vertices
+    """
+
+    cos = np.cos(poses[..., 2])[..., None]
+    sin = np.sin(poses[..., 2])[..., None]
+    lx = local_vertices[..., 0]
+    ly = local_vertices[..., 1]
+    world = np.empty(np.broadcast(lx, cos).shape + (2,))
+    world[..., 0] = cos*lx - sin*ly + poses[..., 0, None]
+    world[..., 1] = sin*lx + cos*ly + poses[..., 1, None]
+    return world
+
+
 class  Box2DSim(object):
     """ 2D physics using box2d and a json conf file
     """
 
-    def __init__(self, world_file, dt=1/80.0, vel_iters=30, pos_iters=2):
+    def __init__(self, world_file, dt=1/80.0, vel_iters=30, pos_iters=2,
+            pids=None, touch_intensity=False):
         """ 
         Args:
 
@@ -17,6 +109,11 @@ class  Box2DSim(object):
             dt (float): the amount of time to simulate, this should not vary.
             pos_iters (int): for the velocity constraint solver.
             vel_iters (int): for the position constraint solver.
+            pids (PIDBank): optional bank of joint controllers, one per
+                joint in the order of self.joints. Batched simulations 
+                pass a view of a larger bank.
+            touch_intensity (bool): also accumulate contact impulses 
+                into self.contact_sensors.impulses
             
         """
 
@@ -27,8 +124,211 @@ class  Box2DSim(object):
         self.world = world
         self.bodies = bodies
         self.joints = joints
-        self.joint_pids = { ("%s" % k): PID(dt=self.dt) 
-                for k in list(self.joints.keys()) }
+        self.joint_list = list(self.joints.values())
+        self.joint_index = {k: i for i, k in enumerate(self.joints.keys())}
+        if pids is None:
+            pids = PIDBank(len(self.joint_list), dt=self.dt)
+        self.pids = pids
+        self.joint_angles = np.zeros(len(self.joint_list))
+        self.body_index = {k: i for i, k in enumerate(self.bodies.keys())}
+        self.body_list = list(self.bodies.values())
+        # vertices of the first fixture of each body, in body coordinates
+        self.local_vertices = pad_polygons([body.fixtures[0].shape.vertices 
+            for body in self.body_list])
+        self.body_poses = np.zeros([len(self.body_list), 3])
+        # poses are cached between reads: static bodies only move when
+        # their transform is set and a sleeping body cannot move, fall 
+        # asleep again and be read asleep unless timeToSleep has passed
+        self.num_steps = 0
+        self.sleep_steps = int(np.ceil(b2.b2_timeToSleep/dt))
+        self.moving_bodies = [i for i, b in enumerate(self.body_list)
+                if b.type != b2.b2_staticBody]
+        self.pose_cache = np.zeros([len(self.body_list), 3])
+        # incremented each time the cached pose of a body is read again,
+        # so that consumers can tell which bodies may have moved
+        self.pose_versions = np.zeros(len(self.body_list), dtype=int)
+        self._was_awake = [True]*len(self.body_list)
+        self._pose_rows = None
+        self._poses_read_at = None
+        self.contact_sensors = ContactSensors(self.bodies, touch_intensity)
+        self.world.contactListener = self.contact_sensors
+
+        # the flat state vector holds a row of fields for each body, 
+        # then a row for each joint, see get_state
+        self.body_state_fields = [("position", 2), ("angle", 1), 
+                ("linearVelocity", 2), ("angularVelocity", 1), ("awake", 1)]
+        self.joint_state_fields = [("motorSpeed", 1), ("pid", 5)]
+        self.state_size = len(self.body_list)*7 + len(self.joint_list)*6
+
+        self.cold_start = False
+        self.init_state = self.snapshot()
+
+        # a Profiler timing the phases of step, None when disabled
+        self.profiler = None
+
+    def unpack_state(self, state):
+        """ Views over the fields of flat states
+
+        Args:
+
+            state (np.ndarray): a (..., state_size) array of states
+
+        Returns:
+
+            (dict): name -> (..., num_bodies[, size]) or 
+                (..., num_joints[, size]) view of each field of
+                self.body_state_fields and self.joint_state_fields
+        """
+
+        lead = state.shape[:-1]
+        split = len(self.body_list)*7
+        rows = [(state[..., :split].reshape(lead + (-1, 7)), 
+            self.body_state_fields), 
+            (state[..., split:].reshape(lead + (-1, 6)), 
+                self.joint_state_fields)]
+        fields = {}
+        for block, block_fields in rows:
+            start = 0
+            for name, size in block_fields:
+                fields[name] = block[..., start] if size == 1 else \
+                        block[..., start:start + size]
+                start += size
+        return fields
+
+    def get_state(self, out=None):
+        """ Capture the dynamic state of the simulation in a flat array
+
+        For each body (in the order of self.bodies) x, y, angle, linear 
+        and angular velocities and the awake flag, then for each joint 
+        (in the order of self.joints) the motor speed and the PID 
+        setpoint, integral, previous error, derivative and output.
+
+        Args:
+
+            out (np.ndarray): optional (state_size,) output buffer
+
+        Returns:
+
+            (np.ndarray): the (state_size,) state
+        """
+
+        if out is None:
+            out = np.zeros(self.state_size)
+        split = len(self.body_list)*7
+        rows = []
+        for b in self.body_list:
+            p = b.position
+            v = b.linearVelocity
+            rows.append((p.x, p.y, b.angle, v.x, v.y, 
+                b.angularVelocity, b.awake))
+        out[:split].reshape(-1, 7)[:] = rows
+
+        joints = out[split:].reshape(-1, 6)
+        pids = self.pids
+        joints[:, 0] = [j.motorSpeed for j in self.joint_list]
+        joints[:, 1] = pids.setpoint
+        joints[:, 2] = pids.integral
+        joints[:, 3] = pids.previous_error
+        joints[:, 4] = pids.derivative
+        joints[:, 5] = pids.output
+        return out
+
+    def set_state(self, state):
+        """ Restore in place a state returned by get_state
+
+        A restored simulation replays bit-identically the same actions 
+        each time it is restored. It can slightly differ from the 
+        simulation the state was taken from, since the solver does not
+        warm start from impulses that are not part of the state.
+
+        Args:
+
+            state (np.ndarray): a (state_size,) state
+
+        """
+
+        self.restore(self.unpack_state(np.asarray(state, dtype=float)))
+
+    def snapshot(self):
+        """ Capture the dynamic state of the simulation
+
+        Returns:
+
+            (dict): body transforms, velocities and awake flags, 
+                joint motor speeds and PID internals, 
+                views over a flat state (see get_state)
+        """
+
+        return self.unpack_state(self.get_state())
+
+    def restore(self, state):
+        """ Restore in place a state captured by snapshot
+
+        Args:
+
+            state (dict): a state returned by snapshot
+
+        """
+
+        for body, position, angle, velocity, angular in zip(
+                self.body_list, state["position"].tolist(), 
+                state["angle"].tolist(), state["linearVelocity"].tolist(),
+                state["angularVelocity"].tolist()):
+            body.transform = (position, angle)
+            body.linearVelocity = velocity
+            body.angularVelocity = angular
+        for joint, speed in zip(self.joint_list, 
+                state["motorSpeed"].tolist()):
+            joint.motorSpeed = speed
+        pids = self.pids
+        pids.setpoint[:], pids.integral[:], pids.previous_error[:], \
+                pids.derivative[:], pids.output[:] = state["pid"].T
+        # a zero-length step updates the contacts to the new
+        # transforms without solving anything
+        self.world.Step(0, 0, 0)
+        # motors and new contacts wake bodies up, 
+        # sleeping ones are put back to sleep
+        for body, awake in zip(self.body_list, state["awake"].tolist()):
+            body.awake = bool(awake)
+        self.invalidate_poses()
+        # joints and contacts keep the impulses of the last solve,
+        # the next step must not warm start from them
+        self.cold_start = True
+        self.contact_sensors.clear_peaks()
+
+    def reset(self, body_poses=None):
+        """ Restore the state the simulation had after construction
+
+        Args:
+
+            body_poses (dict): optional name -> (x, y, angle) initial 
+                poses overriding the ones in the world file
+
+        """
+
+        self.restore(self.init_state)
+        if body_poses is not None:
+            for name, (x, y, angle) in body_poses.items():
+                self.bodies[name].transform = ((x, y), angle)
+            self.world.Step(0, 0, 0)
+            self.contact_sensors.clear_peaks()
+            self.invalidate_poses()
+
+    def initial_pose(self, name):
+        """ The pose of a body after construction
+
+        Args:
+
+            name (string): the name of the body
+
+        Returns:
+
+            (np.ndarray): x, y and angle of the body
+        """
+
+        i = list(self.bodies.keys()).index(name)
+        return np.hstack((self.init_state["position"][i], 
+            self.init_state["angle"][i]))
         
     def contacts(self, bodyA, bodyB): 
         """ Read contacts between two parts of the simulation
@@ -43,13 +343,80 @@ class  Box2DSim(object):
             (int): number of contacts
         """
 
-        contacts = 0
-        for ce in self.bodies[bodyA].contacts:
-            if ce.contact.touching is True:
-                if ce.contact.fixtureB.body  == self.bodies[bodyB]:
-                        contacts += 1       
-        return contacts
+        return int(self.contact_sensors.touches[self.body_index[bodyA],
+            self.body_index[bodyB]])
     
+    def read_body_poses(self, out=None):
+        """ Read the current x, y and angle of all bodies
+
+        Args:
+
+            out (np.ndarray): where to write the poses, 
+                defaults to self.body_poses
+
+        Returns:
+
+            (np.ndarray): a (num_bodies, 3) array of poses 
+                in the order of self.bodies
+        """
+        if out is None:
+            out = self.body_poses
+        cache = self.pose_cache
+        versions = self.pose_versions
+        bodies = self.body_list
+        read_at = self._poses_read_at
+        if read_at is None or self.num_steps - read_at >= self.sleep_steps:
+            rows = []
+            for b in bodies:
+                p = b.position
+                rows.append((p.x, p.y, b.angle))
+            cache[:] = rows
+            versions += 1
+            self._pose_rows = rows
+            self._was_awake = [b.awake for b in bodies]
+        elif read_at != self.num_steps:
+            was_awake = self._was_awake
+            rows = self._pose_rows
+            for i in self.moving_bodies:
+                b = bodies[i]
+                awake = b.awake
+                # a body falling asleep moved during its last step
+                if awake or was_awake[i]:
+                    p = b.position
+                    rows[i] = (p.x, p.y, b.angle)
+                    versions[i] += 1
+                was_awake[i] = awake
+            cache[:] = rows
+        self._poses_read_at = self.num_steps
+        out[:] = cache
+        return out
+
+    def invalidate_poses(self):
+        """ Read all poses again at the next read_body_poses
+
+        To be called after setting body transforms by hand.
+        """
+        self._poses_read_at = None
+
+    def world_vertices(self, poses=None):
+        """ Vertices of all bodies in world coordinates
+
+        The cached body-local vertices are transformed all at once 
+        instead of calling body.GetWorldPoint for each vertex.
+
+        Args:
+
+            poses (np.ndarray): (num_bodies, 3) poses, 
+                defaults to the current ones
+
+        Returns:
+
+            (np.ndarray): a (num_bodies, num_vertices, 2) array
+        """
+        if poses is None:
+            poses = self.read_body_poses()
+        return transform_vertices(self.local_vertices, poses)
+
     def move(self, joint_name, angle):
         """ change the angle of a joint
 
@@ -59,16 +426,61 @@ class  Box2DSim(object):
             angle (float): the new angle position
 
         """
-        pid = self.joint_pids[joint_name]
-        pid.setpoint = angle
+        self.pids.setpoint[self.joint_index[joint_name]] = angle
+
+    def read_joint_angles(self, out=None):
+        """ Read the current angles of all joints
+
+        Args:
+
+            out (np.ndarray): where to write the angles, 
+                defaults to self.joint_angles
+
+        Returns:
+
+            (np.ndarray): angles in the order of self.joints
+        """
+        if out is None:
+            out = self.joint_angles
+        out[:] = [joint.angle for joint in self.joint_list]
+        return out
+
+    def apply_pid_outputs(self):
+        """ Use the current PID outputs as joint motor speeds
+        """
+        for joint, speed in zip(self.joint_list, self.pids.output.tolist()):
+            joint.motorSpeed = speed
         
     def step(self):
         """ A simulation step
         """
-        for key in list(self.joints.keys()):
-            self.joint_pids[key].step(self.joints[key].angle)
-            self.joints[key].motorSpeed = (self.joint_pids[key].output)
-        self.world.Step(self.dt, self.vel_iters, self.pos_iters)
+        profiler = self.profiler
+        if profiler is None:
+            self.pids.step(self.read_joint_angles())
+            self.apply_pid_outputs()
+            self.world_step()
+        else:
+            profiler.start()
+            self.pids.step(self.read_joint_angles())
+            self.apply_pid_outputs()
+            profiler.lap("pid")
+            self.world_step()
+            profiler.lap("world_step")
+
+    def world_step(self):
+        """ Advance the physics of one step
+        """
+        if self.contact_sensors.intensity:
+            self.contact_sensors.impulses[:] = 0
+        if self.cold_start:
+            warm_starting = self.world.warmStarting
+            self.world.warmStarting = False
+            self.world.Step(self.dt, self.vel_iters, self.pos_iters)
+            self.world.warmStarting = warm_starting
+            self.cold_start = False
+        else:
+            self.world.Step(self.dt, self.vel_iters, self.pos_iters)
+        self.num_steps += 1
         
 
 #------------------------------------------------------------------------------ 
@@ -80,13 +492,15 @@ class VisualSensor:
     """ Compute the retina state at each ste of simulation
     """
 
-    def __init__(self, sim, size, rng):
+    def __init__(self, sim, size, rng, antialiasing=1):
         """
         Args:
 
             sim (Box2DSim): a simulator object
             size (int, int): width, height of the retina in pixels
             rng (float, float): x and y range in the task space
+            antialiasing (int): each pixel is the mean of
+                antialiasing x antialiasing samples
 
         """
 
@@ -100,7 +514,14 @@ class VisualSensor:
         self.scale = np.array(rng)/size
         self.radius = np.mean(np.array(rng)/size)
         self.sim = sim
-        self.retina = np.zeros(self.size)
+        self.retina = np.zeros(self.size[::-1])
+        # pixels within radius/2 of a body are filled, 
+        # as Path.contains_points does with counter-clockwise paths
+        self.rasterizer = PolygonRasterizer(self.size, rng, 
+                margin=0.5*self.radius, antialiasing=antialiasing)
+        # pose versions and focus of the current retina
+        self.versions = None
+        self.focus = None
 
     def step(self, focus) :
         """ Run a single simulator step
@@ -115,18 +536,21 @@ class VisualSensor:
             (np.ndarray): a rescaled retina state
         """
    
-        self.retina *= 0
-        for key in self.sim.bodies.keys():
-            body = self.sim.bodies[key]
-            vercs = np.vstack(body.fixtures[0].shape.vertices)
-            vercs = vercs[np.arange(len(vercs))+[0]]
-            data = [body.GetWorldPoint(vercs[x]) 
-                for x in range(len(vercs))]
-            self.retina += self.path2pixels(data, focus)
-
-        return self.retina
+        poses = self.sim.read_body_poses()
+        versions = self.sim.pose_versions
+        focus = tuple(focus)
+        # nothing moved, e.g. all bodies are static or asleep
+        if focus == self.focus and np.array_equal(versions, self.versions):
+            return self.retina
+        self.versions = versions.copy()
+        self.focus = focus
+        return self.rasterizer.render(self.sim.world_vertices(poses), focus,
+                out=self.retina)
 
     def path2pixels(self, vertices, focus):
+        """ Rasterize a single path with matplotlib (reference 
+        implementation of step)
+        """
 
         points = self.grid * self.scale + focus
         
@@ -135,10 +559,60 @@ class VisualSensor:
         img = 1.0*points_in_path.reshape(*self.size, order='F').T #pixels 
             
         return img
+
+
+class VecVisualSensor:
+    """ Compute the retinae of many simulations from many foci at once
+    """
+
+    def __init__(self, sims, size, rng, antialiasing=1):
+        """
+        Args:
+
+            sims (list): Box2DSim objects built from the same world file
+            size (int, int): width, height of the retina in pixels
+            rng (float, float): x and y range in the task space
+            antialiasing (int): each pixel is the mean of
+                antialiasing x antialiasing samples
+
+        """
+
+        self.size = np.copy(size)
+        self.sims = sims
+        self.radius = np.mean(np.array(rng)/size)
+        self.rasterizer = PolygonRasterizer(self.size, rng, 
+                margin=0.5*self.radius, antialiasing=antialiasing)
+        # all worlds share the same bodies, hence the same local vertices
+        self.local_vertices = sims[0].local_vertices
+        self.poses = np.zeros((len(sims),) + sims[0].body_poses.shape)
+        self.retinae = None
+
+    def step(self, foci):
+        """ Compute all retinae
+
+        Args:
+
+            foci (np.ndarray): (num_sims, K, 2) visual field centers,
+                K foci for each simulation
+
+        Returns:
+
+            (np.ndarray): a (num_sims, K, height, width) array
+        """
+
+        foci = np.asarray(foci, dtype=float)
+        shape = foci.shape[:2] + tuple(self.size[::-1])
+        if self.retinae is None or self.retinae.shape != shape:
+            self.retinae = np.zeros(shape)
+        for sim, poses in zip(self.sims, self.poses):
+            sim.read_body_poses(poses)
+        polygons = transform_vertices(self.local_vertices, self.poses)
+
+        return self.rasterizer.render_batch(polygons, foci, 
+                out=self.retinae)
 #------------------------------------------------------------------------------ 
 #------------------------------------------------------------------------------ 
 
-import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.patches import Polygon
 from matplotlib.collections import PatchCollection
@@ -147,17 +621,25 @@ class TestPlotter:
     """ Plotter of simulations
     Builds a simple matplotlib graphic environment 
     and render single steps of the simulation within it
+
+    In interactive mode the axes are drawn once and cached as a background,
+    then only the body polygons are redrawn and blitted at each frame.
+    Frames can be rendered once every render_interval steps.
      
     """
 
-    def __init__(self, env, xlim=[-10, 30], ylim=[-10, 30], offline=False):
+    def __init__(self, env, xlim=[-10, 30], ylim=[-10, 30], offline=False,
+            render_interval=1):
         """
         Args:
             env (Box2DSim): a emulator object
+            render_interval (int): in interactive mode, only one call to 
+                step every render_interval updates the figure
             
             """
         self.env = env
         self.offline = offline
+        self.render_interval = render_interval
         self.fig = plt.figure()
         self.ax = self.fig.add_subplot(111, aspect="equal")
         self.polygons = {}
@@ -166,40 +648,75 @@ class TestPlotter:
                 self.polygons[key] = Polygon([[0, 0]],
                         ec=[0, 0, 0, 1],
                         fc=[.6, 0.6, 0.6, 1], 
-                        closed=True)
+                        closed=True, animated=not offline)
             else:
                 self.polygons[key] = Polygon([[0, 0]],
                         ec=[0.0, 0.1, 0.0, 1], 
                         fc=[0.3, 0.8, 0.3, 1], 
-                        closed=True)
+                        closed=True, animated=not offline)
 
             self.ax.add_artist(self.polygons[key])
         self.ax.set_xlim(xlim)
         self.ax.set_ylim(ylim)
+        self.ts = 0
+        # pose versions of the drawn polygons
+        self.versions = None
         if not self.offline:
+            # the background is grabbed again whenever the whole 
+            # figure is redrawn, e.g. after a resize
+            self.background = None
+            self.blit = self.fig.canvas.supports_blit
+            self.fig.canvas.mpl_connect("draw_event", self.onDraw)
             self.fig.show()
-        else:
-            self.ts = 0
+            self.fig.canvas.draw()
 
     def onStep(self):
         pass
 
+    def onDraw(self, event):
+        """ Cache the static background and draw the animated polygons
+        """
+        canvas = self.fig.canvas
+        self.background = canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        for polygon in self.polygons.values():
+            self.ax.draw_artist(polygon)
+
     def step(self) :
         """ Run a single emulator step
         """
         
-        for key in self.polygons:
-            body = self.env.sim.bodies[key]
-            vercs = np.vstack(body.fixtures[0].shape.vertices)
-            data = np.vstack([ body.GetWorldPoint(vercs[x]) 
-                for x in range(len(vercs))])
-            self.polygons[key].set_xy(data)
+        if not self.offline:
+            self.ts += 1
+            if (self.ts - 1) % self.render_interval != 0:
+                return
+
+        sim = self.env.sim
+        poses = sim.read_body_poses()
+        versions = sim.pose_versions
+        # only bodies that may have moved get new vertices
+        moved = np.ones(len(versions), dtype=bool) \
+                if self.versions is None else versions != self.versions
+        self.versions = versions.copy()
+        if moved.any():
+            vertices = sim.world_vertices(poses)
+            polygons = list(self.polygons.values())
+            for i in np.flatnonzero(moved):
+                polygons[i].set_xy(vertices[i])
         
         self.onStep()
 
         if not self.offline:
-            self.fig.canvas.flush_events()
-            self.fig.canvas.draw()
+            canvas = self.fig.canvas
+            if self.blit and self.background is not None:
+                canvas.restore_region(self.background)
+                self.draw_artists()
+                canvas.blit(self.fig.bbox)
+            else:
+                canvas.draw()
+            canvas.flush_events()
         else:
             if not os.path.exists("frames"):
                 os.makedirs("frames")
@@ -209,3 +726,234 @@ class TestPlotter:
             self.ts += 1
 
 
+
+#------------------------------------------------------------------------------ 
+#------------------------------------------------------------------------------ 
+
+import subprocess
+import zipfile
+
+class FrameRenderer:
+    """ Draw the bodies of a simulation into an RGB array
+
+    Polygons are rasterized into filled row intervals, whose layers are
+    painted into a reused supersampled buffer of labels, the topmost 
+    layer winning. Only the pixels whose samples have different labels
+    are averaged, the others take the color of their label. No 
+    matplotlib figure is involved and the cost grows with the area 
+    covered by bodies rather than with the number of pixels.
+    """
+
+    def __init__(self, env, xlim=[-10, 30], ylim=[-10, 30], 
+            size=(320, 320), antialiasing=2, edge_width=None):
+        """
+        Args:
+            env (Box2DSimOneArmEnv): an environment with sim and
+                robot_parts_names attributes
+            xlim, ylim (float, float): the rendered region of the task space
+            size (int, int): width, height of the frames in pixels
+            antialiasing (int): supersampling factor of the edges
+            edge_width (float): width of the body outlines in 
+                task-space units, defaults to one pixel
+
+        """
+        self.env = env
+        self.size = np.array(size, dtype=int)
+        self.antialiasing = int(antialiasing)
+        rng = (xlim[1] - xlim[0], ylim[1] - ylim[0])
+        self.focus = np.array([[[np.mean(xlim), np.mean(ylim)]]])
+        if edge_width is None:
+            edge_width = np.max(np.array(rng)/self.size)
+        self.fill = PolygonRasterizer(self.size, rng, 
+                antialiasing=antialiasing)
+        self.outline = PolygonRasterizer(self.size, rng, margin=edge_width,
+                antialiasing=antialiasing)
+
+        # same colors as TestPlotter, edges at even and faces at odd
+        # indices so that the painting order is 2*body + face
+        robot = np.array([key in env.robot_parts_names 
+            for key in env.sim.bodies.keys()])
+        face_colors = np.where(robot[:, None], 
+                [0.6, 0.6, 0.6], [0.3, 0.8, 0.3])
+        edge_colors = np.where(robot[:, None], 
+                [0.0, 0.0, 0.0], [0.0, 0.1, 0.0])
+        colors = np.stack([edge_colors, face_colors], 1).reshape(-1, 3)
+        # label 0 is the white background, label l + 1 is layer l
+        colors = np.vstack([[1.0, 1.0, 1.0], colors])
+        self.colors = np.rint(colors*255).astype(np.uint8)
+
+        w, h = self.size*self.antialiasing
+        self.labels = np.zeros([h, w], dtype=np.uint8)
+        self.frame = np.zeros([self.size[1], self.size[0], 3], 
+                dtype=np.uint8)
+        # pose versions of the current frame
+        self.versions = None
+
+    def draw(self):
+        """ Draw the current state of the simulation
+
+        Returns:
+
+            (np.ndarray): a (height, width, 3) uint8 frame, 
+                overwritten by the next call
+        """
+        sim = self.env.sim
+        poses = sim.read_body_poses()
+        if np.array_equal(sim.pose_versions, self.versions):
+            return self.frame
+        self.versions = sim.pose_versions.copy()
+        polygons = sim.world_vertices(poses)[None]
+        _, edge_body, edge_rows, edge_first, edge_last = \
+                self.outline.spans(polygons, self.focus)
+        _, face_body, face_rows, face_first, face_last = \
+                self.fill.spans(polygons, self.focus)
+
+        # painter's algorithm: each sample takes the label of the
+        # topmost interval covering it
+        label = np.concatenate((2*edge_body + 1, 2*face_body + 2))
+        rows = np.concatenate((edge_rows, face_rows))
+        first = np.concatenate((edge_first, face_first))
+        length = np.concatenate((edge_last, face_last)) - first
+        labels = self.labels
+        labels[:] = 0
+        ws = labels.shape[1]
+        start = rows*ws + first
+        offset = np.cumsum(length) - length
+        samples = np.repeat(start - offset, length) + \
+                np.arange(length.sum())
+        np.maximum.at(labels.ravel(), samples, 
+                np.repeat(label, length).astype(np.uint8))
+
+        # only the pixels in the bounding box of the intervals are
+        # not white
+        aa = self.antialiasing
+        frame = self.frame
+        frame[:] = 255
+        if len(rows) == 0:
+            return frame
+        top, bottom = rows.min()//aa, rows.max()//aa + 1
+        left = first.min()//aa
+        right = -(-(first + length).max()//aa)
+        labels = labels[top*aa:bottom*aa, left*aa:right*aa]
+        out = frame[top:bottom, left:right]
+        subsamples = [labels[i::aa, j::aa] 
+                for i in range(aa) for j in range(aa)]
+        self.colors.take(subsamples[0], axis=0, out=out)
+        if aa == 1:
+            return frame
+
+        # pixels on edges are the mean of their samples, computed in 
+        # integers and rounded half to even as np.rint
+        mixed = np.zeros(out.shape[:2], dtype=bool)
+        for sub in subsamples[1:]:
+            mixed |= sub != subsamples[0]
+        r, c = np.divmod(np.flatnonzero(mixed), out.shape[1])
+        total = sum(self.colors.take(sub[r, c], axis=0).astype(np.int32)
+                for sub in subsamples)
+        n = aa*aa
+        mean, rest = np.divmod(total, n)
+        mean += (2*rest > n) | ((2*rest == n) & (mean % 2 == 1))
+        out[r, c] = mean
+
+        return frame
+
+
+class FrameRecorder:
+    """ Record frames of a simulation into a file
+
+    The sink depends on the file extension:
+
+        .npy: frames are streamed into a (T, height, width, 3) uint8 array 
+            that can be memory-mapped with np.load(..., mmap_mode='r')
+        .npz: as .npy, then compressed into an npz archive at close 
+        anything else: raw frames are piped into an encoder process 
+            (ffmpeg by default), e.g. for .mp4 videos
+
+    Frames are rendered with FrameRenderer, so that recording does not 
+    involve matplotlib at all.
+    """
+
+    header_size = 128
+
+    def __init__(self, env, filename="frames/frames.npy", 
+            xlim=[-10, 30], ylim=[-10, 30], size=(320, 320), 
+            frame_skip=1, fps=25, encoder=None, antialiasing=2):
+        """
+        Args:
+            env (Box2DSimOneArmEnv): the environment to record
+            filename (string): the output file
+            xlim, ylim (float, float): the rendered region of the task space
+            size (int, int): width, height of the frames in pixels
+            frame_skip (int): only one step every frame_skip is recorded
+            fps (int): frame rate of encoded videos
+            encoder (list): command of the encoder, reading raw rgb24 
+                frames from stdin. Defaults to ffmpeg.
+            antialiasing (int): supersampling factor of the edges
+
+        """
+        self.env = env
+        self.renderer = FrameRenderer(env, xlim, ylim, size, antialiasing)
+        self.filename = filename
+        self.frame_skip = frame_skip
+        self.ts = 0
+        self.num_frames = 0
+        self.closed = False
+
+        dirname = os.path.dirname(filename)
+        if dirname != "" and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        w, h = self.renderer.size
+        ext = os.path.splitext(filename)[1]
+        self.process = None
+        if ext in [".npy", ".npz"]:
+            self.npy_filename = filename if ext == ".npy" else \
+                    filename + ".tmp.npy"
+            self.stream = open(self.npy_filename, "wb")
+            self._write_header()
+        else:
+            if encoder is None:
+                encoder = ["ffmpeg", "-y", "-loglevel", "error", 
+                        "-f", "rawvideo", "-pix_fmt", "rgb24", 
+                        "-s", "%dx%d" % (w, h), "-r", str(fps), 
+                        "-i", "-", "-pix_fmt", "yuv420p", filename]
+            self.process = subprocess.Popen(encoder, stdin=subprocess.PIPE)
+            self.stream = self.process.stdin
+
+    def _write_header(self):
+        # a fixed-size npy header, rewritten with the final 
+        # number of frames at close
+        w, h = self.renderer.size
+        header = "{'descr': '|u1', 'fortran_order': False, " \
+                "'shape': (%d, %d, %d, 3), }" % (self.num_frames, h, w)
+        header = header.ljust(self.header_size - 11) + "\n"
+        self.stream.write(b"\x93NUMPY\x01\x00" + 
+                np.uint16(len(header)).tobytes() + header.encode("latin1"))
+
+    def step(self):
+        """ Record the current state, if not skipped
+        """
+        if self.ts % self.frame_skip == 0:
+            self.stream.write(self.renderer.draw().tobytes())
+            self.num_frames += 1
+        self.ts += 1
+
+    def close(self):
+        """ Finalize the file
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.process is not None:
+            self.stream.close()
+            self.process.wait()
+            return
+
+        self.stream.seek(0)
+        self._write_header()
+        self.stream.close()
+        if self.npy_filename != self.filename:
+            with zipfile.ZipFile(self.filename, "w", 
+                    zipfile.ZIP_DEFLATED) as archive:
+                archive.write(self.npy_filename, "frames.npy")
+            os.remove(self.npy_filename)
@@ -0,0 +1,464 @@
+import traceback
+import numpy as np
+import multiprocessing as mp
+import gym
+from .VecBox2DSim_env import VecBox2DSim
+from .Simulator import VecVisualSensor
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+class SharedBuffers(object):
+    """ Preallocated numpy arrays living in shared memory
+
+    The raw arrays are created once in the parent process and handed to
+    the workers at start, so that actions and observations travel through
+    memory instead of being pickled at each step.
+    """
+
+    def __init__(self, specs):
+        """
+        Args:
+
+            specs (dict): name -> (shape, dtype) of each buffer
+
+        """
+
+        self.specs = specs
+        self.raw = {name: mp.RawArray('b', max(1,
+            int(np.prod(shape))*np.dtype(dtype).itemsize))
+            for name, (shape, dtype) in specs.items()}
+        self.attach()
+
+    def attach(self):
+        """ Build the numpy views over the raw arrays
+        """
+
+        self.arrays = {}
+        for name, (shape, dtype) in self.specs.items():
+            size = int(np.prod(shape))
+            self.arrays[name] = np.frombuffer(self.raw[name],
+                    dtype=dtype, count=size).reshape(shape)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __getstate__(self):
+        return {"specs": self.specs, "raw": self.raw}
+
+    def __setstate__(self, state):
+        self.specs = state["specs"]
+        self.raw = state["raw"]
+        self.attach()
+
+
+class WorkerError(object):
+    """ An exception raised in a worker, sent back as its reply
+    """
+
+    def __init__(self, message):
+        self.message = message
+
+
+def receive(remotes):
+    """ The replies of a set of workers
+
+    All replies are read, so that pipes stay in sync even if a worker
+    failed.
+
+    Args:
+
+        remotes (list): the parent ends of the command pipes
+
+    Returns:
+
+        (list): the reply of each worker
+
+    Raises:
+
+        RuntimeError: if a worker raised an exception or exited
+    """
+
+    replies = []
+    for remote in remotes:
+        try:
+            replies.append(remote.recv())
+        except (EOFError, OSError):
+            replies.append(WorkerError("the worker exited"))
+    for reply in replies:
+        if isinstance(reply, WorkerError):
+            raise RuntimeError("worker failed:\n%s" % reply.message)
+    return replies
+
+
+def send(remote, message):
+    """ Send a command to a worker
+
+    Raises:
+
+        RuntimeError: if the worker exited
+    """
+
+    try:
+        remote.send(message)
+    except OSError:
+        raise RuntimeError("worker failed:\nthe worker exited")
+
+
+def _worker(remote, parent_remote, world_file, start, stop, buffers,
+        retina_size, retina_range):
+    """ Run a shard of worlds in a subprocess
+
+    Args:
+
+        remote (Connection): the worker end of the command pipe
+        parent_remote (Connection): the parent end, closed in the worker
+        world_file (string): the json file from which worlds are created
+        start, stop (int): the slice of the global batch owned by this worker
+        buffers (SharedBuffers): the shared observation and action buffers
+        retina_size (int, int): retina size or None
+        retina_range (float, float): retina range in the task space
+
+    """
+
+    parent_remote.close()
+    venv = VecBox2DSim(stop - start, world_file)
+    shard = slice(start, stop)
+    actions = buffers["actions"][shard]
+    joints = buffers["joint_positions"][shard]
+    sensors = buffers["touch_sensors"][shard]
+    obj_pos = buffers["obj_positions"][shard]
+    rewards = buffers["rewards"][shard]
+    dones = buffers["dones"][shard]
+    visual_sensor = None
+    if retina_size is not None:
+        retinae = buffers["retinae"][shard]
+        foci = buffers["foci"][shard]
+        visual_sensor = VecVisualSensor(venv.sims, retina_size, retina_range)
+
+    def write_observation(observation):
+        joints[:] = observation["JOINT_POSITIONS"]
+        sensors[:] = observation["TOUCH_SENSORS"]
+        obj_pos[:] = observation["OBJ_POSITION"]
+        if visual_sensor is not None:
+            retinae[:] = visual_sensor.step(foci[:, None])[:, 0]
+
+    def execute(cmd, data):
+        if cmd == "step":
+            observation, rew, done, _ = venv.step(actions)
+            write_observation(observation)
+            rewards[:] = rew
+            dones[:] = done
+        elif cmd == "reset":
+            write_observation(venv.reset(data))
+        elif cmd == "seed":
+            return venv.seed(data + start)
+        elif cmd == "set_object_init_range":
+            venv.object_init_range = data
+        elif cmd == "set_reward_fun":
+            venv.set_reward_fun(data)
+        elif cmd == "set_done_fun":
+            venv.set_done_fun(data)
+        elif cmd == "set_auto_reset":
+            venv.auto_reset = data
+        elif cmd == "close":
+            venv.close()
+        else:
+            raise NotImplementedError("unknown command %s" % cmd)
+
+    try:
+        while True:
+            cmd = None
+            try:
+                # arguments that cannot be unpickled fail here
+                cmd, data = remote.recv()
+                reply = execute(cmd, data)
+            except EOFError:
+                break
+            except Exception:
+                # the parent raises it, the worker keeps serving
+                reply = WorkerError(traceback.format_exc())
+            remote.send(reply)
+            if cmd == "close":
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        remote.close()
+
+#------------------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+class SubprocVecBox2DSim(object):
+    """ One-arm worlds sharded across worker processes
+
+    Each worker owns a VecBox2DSim over a contiguous slice of the batch.
+    Actions are written into a shared buffer and workers write joint
+    positions, touch sensors, object positions, rewards, done flags and
+    (optionally) retina images into shared buffers, so that the pipes
+    only carry short commands.
+    """
+
+    def __init__(self, num_envs, world_file=None, num_workers=None,
+            retina_size=None, retina_range=(40, 40), start_method=None):
+        """
+        Args:
+
+            num_envs (int): number of worlds
+            world_file (string): the json file from which all worlds are
+                created. Defaults to the one-arm scenario.
+            num_workers (int): number of worker processes.
+                Defaults to the number of cpus.
+            retina_size (int, int): if given, a retina of this size is
+                computed for each world at each step
+            retina_range (float, float): x and y range of the retina
+                in the task space
+            start_method (string): multiprocessing start method
+
+        """
+
+        # a throw-away batch of one world gives spaces and names
+        template = VecBox2DSim(1, world_file)
+        self.world_file = template.world_file
+        self.num_envs = num_envs
+        self.robot_parts_names = template.robot_parts_names
+        self.joint_names = template.joint_names
+        self.object_names = template.object_names
+        self.single_action_space = template.single_action_space
+        self.action_space = gym.spaces.Box(-np.pi, np.pi, 
+                [num_envs, template.num_joints], dtype=float)
+
+        if num_workers is None:
+            num_workers = mp.cpu_count()
+        num_workers = max(1, min(num_workers, num_envs))
+        self.num_workers = num_workers
+
+        num_all_joints = len(self.joint_names)
+        num_parts = len(self.robot_parts_names)
+        num_objects = len(self.object_names)
+        specs = {
+            "actions": ((num_envs, template.num_joints), np.float64),
+            "joint_positions": ((num_envs, num_all_joints), np.float64),
+            "touch_sensors": ((num_envs, num_objects, num_parts), np.float64),
+            "obj_positions": ((num_envs, num_objects, 2), np.float64),
+            "rewards": ((num_envs,), np.float64),
+            "dones": ((num_envs,), np.bool_),
+            }
+        self.retina_size = retina_size
+        if retina_size is not None:
+            # retinae are (height, width) images
+            specs["retinae"] = ((num_envs,) + tuple(retina_size[::-1]),
+                    np.float64)
+            specs["foci"] = ((num_envs, 2), np.float64)
+        self.buffers = SharedBuffers(specs)
+        # the same spaces as VecBox2DSim, plus the retinae
+        observation_spaces = {
+            "JOINT_POSITIONS": gym.spaces.Box(-np.inf, np.inf,
+                specs["joint_positions"][0], dtype=float),
+            "TOUCH_SENSORS": gym.spaces.Box(0, np.inf,
+                specs["touch_sensors"][0], dtype=float),
+            "OBJ_POSITION": gym.spaces.Box(-np.inf, np.inf,
+                specs["obj_positions"][0], dtype=float)}
+        if retina_size is not None:
+            observation_spaces["RETINA"] = gym.spaces.Box(0, np.inf,
+                specs["retinae"][0], dtype=float)
+        self.observation_space = gym.spaces.Dict(observation_spaces)
+        if retina_size is not None:
+            # look at the center of the task space by default
+            self.buffers["foci"][:] = 10
+
+        ctx = mp.get_context(start_method)
+        bounds = np.linspace(0, num_envs, num_workers + 1).astype(int)
+        self.bounds = bounds
+        self.remotes, self.work_remotes = zip(
+                *[ctx.Pipe() for _ in range(num_workers)])
+        self.processes = []
+        for work_remote, remote, start, stop in zip(self.work_remotes,
+                self.remotes, bounds[:-1], bounds[1:]):
+            args = (work_remote, remote, self.world_file, start, stop,
+                    self.buffers, retina_size, retina_range)
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.waiting = False
+        self.closed = False
+
+    @property
+    def foci(self):
+        """ (np.ndarray): the (num_envs, 2) shared array of retina foci
+        """
+        return self.buffers["foci"]
+
+    def _observation(self):
+        observation = {
+            "JOINT_POSITIONS": self.buffers["joint_positions"],
+            "TOUCH_SENSORS": self.buffers["touch_sensors"],
+            "OBJ_POSITION": self.buffers["obj_positions"]}
+        if self.retina_size is not None:
+            observation["RETINA"] = self.buffers["retinae"]
+        return observation
+
+    def _call(self, cmd, data=None):
+        for remote in self.remotes:
+            send(remote, (cmd, data))
+        return receive(self.remotes)
+
+    def set_reward_fun(self, rew_fun=None):
+        """ Set the reward function of all workers
+
+        Args:
+
+            rew_fun (callable): a picklable function taking the stacked
+                observation dictionary of a shard and returning a
+                vector of rewards
+
+        """
+
+        self._call("set_reward_fun", rew_fun)
+
+    def set_done_fun(self, done_fun=None):
+        """ Set the termination function of all workers
+
+        Args:
+
+            done_fun (callable): a picklable function taking the stacked
+                observation dictionary of a shard and returning a
+                boolean vector, see VecBox2DSim.set_done_fun
+
+        """
+
+        self._call("set_done_fun", done_fun)
+
+    def set_auto_reset(self, auto_reset=True):
+        """ Reset the worlds that are done at the end of each step
+
+        Each worker resets its own worlds, see VecBox2DSim.step. The
+        observations that ended the episodes are not returned.
+
+        Args:
+
+            auto_reset (bool): whether to reset
+
+        """
+
+        self._call("set_auto_reset", auto_reset)
+
+    def seed(self, seed=None):
+        """ Seed the random generators of all worlds
+
+        Args:
+
+            seed (int): world e gets seed + e, see VecBox2DSim.seed.
+                A random seed if None.
+
+        Returns:
+
+            (list): the seed of each world
+        """
+
+        if seed is None:
+            seed = int(np.random.randint(2**31))
+        self.single_action_space.seed(seed)
+        self.action_space.seed(seed)
+        return sum(self._call("seed", seed), [])
+
+    def set_object_init_range(self, init_range=None):
+        """ Set the initial object pose noise of all workers
+
+        Args:
+
+            init_range (array-like): see Box2DSimOneArmEnv.object_init_range
+
+        """
+
+        self._call("set_object_init_range", init_range)
+
+    def reset(self, mask=None):
+        """ Restore worlds to their initial state
+
+        Args:
+
+            mask (np.ndarray): boolean vector of the worlds to reset.
+                Defaults to all worlds.
+
+        Returns:
+
+            (dict): stacked observations of all worlds
+
+        """
+
+        for remote, start, stop in zip(self.remotes,
+                self.bounds[:-1], self.bounds[1:]):
+            send(remote, ("reset", None if mask is None else mask[start:stop]))
+        receive(self.remotes)
+        return self._observation()
+
+    def step_async(self, actions):
+        """ Start a step of all worlds without waiting for the results
+
+        Args:
+
+            actions (np.ndarray): a (num_envs, 5) array of joint angles
+
+        """
+
+        self.buffers["actions"][:] = actions
+        for remote in self.remotes:
+            send(remote, ("step", None))
+        self.waiting = True
+
+    def step_wait(self):
+        """ Wait for the step started by step_async
+
+        Returns:
+
+            (dict, np.ndarray, np.ndarray, dict): stacked observations,
+                rewards, done flags and info. Arrays are views over the
+                shared buffers and are overwritten by the next step.
+
+        """
+
+        self.waiting = False
+        receive(self.remotes)
+        return (self._observation(), self.buffers["rewards"],
+                self.buffers["dones"], {})
+
+    def step(self, actions):
+        """ Run a single step of all worlds
+
+        Args:
+
+            actions (np.ndarray): a (num_envs, 5) array of joint angles
+
+        Returns:
+
+            (dict, np.ndarray, np.ndarray, dict): see step_wait
+
+        """
+
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.waiting:
+                self.waiting = False
+                receive(self.remotes)
+            self._call("close")
+        except (RuntimeError, OSError):
+            # workers that died cannot be closed, they are terminated
+            pass
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+    def __del__(self):
+        if not getattr(self, "closed", True):
+            self.close()
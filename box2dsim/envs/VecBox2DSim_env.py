@@ -0,0 +1,344 @@
+import numpy as np
+import gym
+from .Simulator import Box2DSim as Sim
+from .PID import PIDBank
+from . import JsonToPyBox2D as json2d
+from .Box2DSim_env import sample_object_poses, ActionMapper
+from . import Rewards
+import pkg_resources
+
+
+def DefaultVecRewardFun(observation):
+    return observation['TOUCH_SENSORS'].sum(axis=(1, 2))
+
+def DefaultVecDoneFun(observation):
+    return np.zeros(len(observation['JOINT_POSITIONS']), dtype=bool)
+
+
+class VecBox2DSim(object):
+    """ N independent one-arm worlds stepped as a single batched environment
+
+    Actions, observations, rewards and done flags are stacked along a
+    leading axis of size num_envs, so that a whole batch is advanced by
+    a single call to step.
+    """
+
+    def __init__(self, num_envs, world_file=None, dt=1/80.0):
+        """
+        Args:
+
+            num_envs (int): number of worlds
+            world_file (string): the json file from which all worlds are
+                created. Defaults to the one-arm scenario.
+            dt (float): the simulation step of all worlds
+
+        """
+
+        if world_file is None:
+            world_file = pkg_resources.resource_filename(
+                    'box2dsim', 'models/arm.json')
+        self.world_file = world_file
+        self.num_envs = num_envs
+
+        # a single bank holds the controllers of all worlds,
+        # each world steps a view on its own row
+        num_sim_joints = len(json2d.loadScene(world_file).joints)
+        self.pids = PIDBank((num_envs, num_sim_joints), dt=dt)
+        self.sims = [Sim(world_file, dt=dt, pids=self.pids.view(e))
+                for e in range(num_envs)]
+
+        self.robot_parts_names = ['Base', 'Arm1', 'Arm2',
+                'Arm3', 'claw11', 'claw21', 'claw12', 'claw22']
+
+        self.joint_names = [
+                'Ground_to_Arm1', 'Arm1_to_Arm2', 'Arm2_to_Arm3',
+                'Arm3_to_Claw11', 'Claw21_to_Claw22',
+                'Arm3_to_Claw21', 'Claw11_to_Claw12']
+
+        self.object_names = ["Object"]
+
+        self.num_joints = 5
+        self.num_touch_sensors = 7
+
+        self.single_action_space = gym.spaces.Box(
+            -np.pi, np.pi, [self.num_joints], dtype=float)
+        self.action_space = gym.spaces.Box(
+            -np.pi, np.pi, [self.num_envs, self.num_joints], dtype=float)
+
+        num_all_joints = len(self.joint_names)
+        num_parts = len(self.robot_parts_names)
+        num_objects = len(self.object_names)
+
+        self.observation_space = gym.spaces.Dict({
+            "JOINT_POSITIONS": gym.spaces.Box(-np.inf, np.inf,
+                [self.num_envs, num_all_joints], dtype=float),
+            "TOUCH_SENSORS": gym.spaces.Box(0, np.inf,
+                [self.num_envs, num_objects, num_parts], dtype=float),
+            "OBJ_POSITION": gym.spaces.Box(-np.inf, np.inf,
+                [self.num_envs, num_objects, 2], dtype=float)
+            })
+
+        # resolve names once so that the step loop only touches
+        # Box2D objects and preallocated arrays
+        self._pid_columns = [self.sims[0].joint_index[name]
+                for name in self.joint_names]
+        self._angles = np.zeros([self.num_envs, num_sim_joints])
+        self._joints = [[sim.joints[name] for name in self.joint_names]
+                for sim in self.sims]
+        self._objects = [[sim.bodies[name] for name in self.object_names]
+                for sim in self.sims]
+        # flat indices of the (objects, parts) block of the touch matrices
+        body_index = self.sims[0].body_index
+        num_bodies = len(body_index)
+        self._touch_indices = np.array([[body_index[o]*num_bodies +
+            body_index[p] for p in self.robot_parts_names]
+            for o in self.object_names])
+        self._touches = [sim.contact_sensors.touches for sim in self.sims]
+
+        self.action_mapper = ActionMapper(self.pids.setpoint, 
+                self._pid_columns)
+        self.joint_positions = np.zeros([self.num_envs, num_all_joints])
+        self.touch_sensors = np.zeros([self.num_envs, num_objects, num_parts])
+        self.obj_positions = np.zeros([self.num_envs, num_objects, 2])
+        self.dones = np.zeros(self.num_envs, dtype=bool)
+
+        # see Box2DSimOneArmEnv.object_init_range
+        self.object_init_range = None
+        self.rngs = [np.random.RandomState() for _ in range(self.num_envs)]
+
+        self.taskspace_xlim = [-10, 30]
+        self.taskspace_ylim = [-10, 30]
+        # object positions at the start of the current episode of each world
+        self.initial_obj_positions = self.get_observation()[2].copy()
+        # if True step resets the worlds that are done, see step
+        self.auto_reset = False
+        # number of simulation steps run with each action, 
+        # see Box2DSimOneArmEnv.action_repeat
+        self.action_repeat = 1
+
+        self.set_reward_fun()
+        self.set_done_fun()
+
+    def set_reward_fun(self, rew_fun=None):
+        """ Set the reward function
+
+        Args:
+
+            rew_fun (callable): a function taking the stacked observation
+                dictionary and returning a vector of num_envs rewards,
+                e.g. a term of the Rewards module
+
+        """
+
+        if rew_fun is None:
+            rew_fun = DefaultVecRewardFun
+        self.reward_fun = Rewards.bind(rew_fun, self)
+
+    def set_done_fun(self, done_fun=None):
+        """ Set the termination function
+
+        Args:
+
+            done_fun (callable): a function taking the stacked observation
+                dictionary and returning a boolean vector of the worlds 
+                whose episode ended, e.g. Rewards.ObjectOutOfBounds().
+                Defaults to episodes that never end
+
+        """
+
+        if done_fun is None:
+            done_fun = DefaultVecDoneFun
+        self.done_fun = Rewards.bind(done_fun, self)
+
+    def seed(self, seed=None):
+        """ Seed the random generators of all worlds
+
+        World e gets seed + e, the same as a Box2DSimOneArmEnv seeded 
+        with seed + e, so that batched and serial runs match.
+
+        Args:
+
+            seed (int): the seed of the first world, a random one if None
+
+        Returns:
+
+            (list): the seed of each world
+        """
+
+        if seed is None:
+            seed = np.random.randint(2**31)
+        seed = int(seed)
+        seeds = [seed + e for e in range(self.num_envs)]
+        self.rngs = [np.random.RandomState(s) for s in seeds]
+        self.single_action_space.seed(seed)
+        self.action_space.seed(seed)
+        return seeds
+
+    def set_action(self, actions):
+        """ Clip a batch of actions and move all joints of all worlds
+
+        Args:
+
+            actions (np.ndarray): a (num_envs, 5) array of joint angles
+
+        """
+
+        self.action_mapper(actions)
+
+        # same as Box2DSim.step, with the controllers of
+        # all worlds updated at once
+        angles = self._angles
+        for _ in range(self.action_repeat):
+            for sim, out in zip(self.sims, angles):
+                sim.read_joint_angles(out)
+            self.pids.step(angles)
+            for sim in self.sims:
+                sim.apply_pid_outputs()
+                sim.world_step()
+
+    def get_observation(self):
+        """ Fill the stacked observation arrays from the current worlds
+
+        Returns:
+
+            (np.ndarray, np.ndarray, np.ndarray): joint positions,
+                touch sensors and object positions of all worlds
+
+        """
+
+        joint_positions = self.joint_positions
+        touch_sensors = self.touch_sensors
+        obj_positions = self.obj_positions
+        touch_indices = self._touch_indices
+
+        for e in range(self.num_envs):
+            joint_positions[e] = [joint.angle for joint in self._joints[e]]
+            np.take(self._touches[e], touch_indices, out=touch_sensors[e])
+            for o, obj in enumerate(self._objects[e]):
+                obj_positions[e, o] = obj.worldCenter
+
+        return joint_positions, touch_sensors, obj_positions
+
+    def observe(self):
+
+        joints, sensors, obj_pos = self.get_observation()
+
+        observation = {
+            "JOINT_POSITIONS": joints,
+            "TOUCH_SENSORS": sensors,
+            "OBJ_POSITION": obj_pos }
+
+        return observation
+
+    def reset(self, mask=None):
+        """ Restore worlds to their initial state
+
+        Args:
+
+            mask (np.ndarray): boolean vector of the worlds to reset.
+                Defaults to all worlds.
+
+        Returns:
+
+            (dict): stacked observations of all worlds
+
+        """
+
+        if mask is None:
+            indices = range(self.num_envs)
+        else:
+            indices = np.flatnonzero(mask)
+        for e in indices:
+            sim = self.sims[e]
+            body_poses = None
+            if self.object_init_range is not None:
+                body_poses = sample_object_poses(sim, self.object_names,
+                        self.object_init_range, self.rngs[e])
+            sim.reset(body_poses)
+
+        observation = self.observe()
+        if mask is None:
+            self.initial_obj_positions[:] = self.obj_positions
+        else:
+            self.initial_obj_positions[indices] = self.obj_positions[indices]
+        return observation
+
+    def get_state(self, out=None):
+        """ The flat states of all worlds, see Box2DSim.get_state
+
+        Args:
+
+            out (np.ndarray): optional (num_envs, state_size) output buffer
+
+        Returns:
+
+            (np.ndarray): the (num_envs, state_size) states
+        """
+
+        if out is None:
+            out = np.zeros([self.num_envs, self.sims[0].state_size])
+        for sim, state in zip(self.sims, out):
+            sim.get_state(state)
+        return out
+
+    def set_state(self, states, mask=None):
+        """ Restore worlds in place
+
+        Args:
+
+            states (np.ndarray): a (num_envs, state_size) array, or a
+                single (state_size,) state given to all worlds
+            mask (np.ndarray): boolean vector of the worlds to restore.
+                Defaults to all worlds.
+
+        Returns:
+
+            (dict): stacked observations of all worlds
+        """
+
+        states = np.broadcast_to(states, 
+                [self.num_envs, self.sims[0].state_size])
+        if mask is None:
+            indices = range(self.num_envs)
+        else:
+            indices = np.flatnonzero(mask)
+        for e in indices:
+            self.sims[e].set_state(states[e])
+
+        return self.observe()
+
+    def step(self, actions):
+        """ Run a single step of all worlds
+
+        Args:
+
+            actions (np.ndarray): a (num_envs, 5) array of joint angles
+
+        With auto_reset the worlds that are done are reset at the end
+        of the step: their rows of the returned observation are the 
+        first of the new episode, the last ones of the ended episode 
+        are in info["final_observation"].
+
+        Returns:
+
+            (dict, np.ndarray, np.ndarray, dict): stacked observations,
+                rewards, done flags and info
+
+        """
+
+        self.set_action(actions)
+        observation = self.observe()
+
+        rewards = self.reward_fun(observation)
+        self.dones[:] = self.done_fun(observation)
+
+        info = {}
+        if self.auto_reset and self.dones.any():
+            info["final_observation"] = {key: value.copy()
+                    for key, value in observation.items()}
+            observation = self.reset(self.dones)
+
+        return observation, rewards, self.dones, info
+
+    def close(self):
+        pass
@@ -1,2 +1,4 @@
 from box2dsim.envs.Box2DSim_env import Box2DSimOneArmEnv 
 
+from box2dsim.envs.VecBox2DSim_env import VecBox2DSim
+from box2dsim.envs.SubprocVecBox2DSim_env import SubprocVecBox2DSim
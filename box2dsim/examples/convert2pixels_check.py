@@ -0,0 +1,27 @@
+""" Check path2pixels on polygons that cover no sample
+
+Polygons outside the image, slivers between sample rows and batches
+of such polygons must give empty float images of the requested size.
+"""
+
+import numpy as np
+from box2dsim.envs.convert2pixels import path2pixels
+
+outside = [(500, 500), (501, 500), (501, 501)]
+sliver = [(1.01, 1.01), (1.02, 1.01), (1.02, 1.02)]
+inside = [(2, 2), (8, 2), (8, 8), (2, 8)]
+
+for name, vertices in [("outside", outside), ("sliver", sliver)]:
+    img = path2pixels(vertices, [0, 10], [0, 10], (5, 5))
+    assert img.shape == (5, 5) and img.dtype == float, name
+    assert not img.any(), name
+    print("%s: empty" % name)
+
+batch = path2pixels(np.array([outside, outside]), [0, 10], [0, 10], (5, 5))
+assert batch.shape == (2, 5, 5) and not batch.any()
+print("batch outside: empty")
+
+mixed = path2pixels([outside, inside], [0, 10], [0, 10], (5, 5))
+single = path2pixels(inside, [0, 10], [0, 10], (5, 5))
+assert not mixed[0].any() and np.array_equal(mixed[1], single)
+print("batch mixed: only the inside polygon is drawn")
@@ -0,0 +1,71 @@
+""" Check that seeded rollouts are bit-identical
+
+The same seeds and actions are run serially, in a VecBox2DSim and in a
+SubprocVecBox2DSim, with random initial object poses. All observations
+must be identical, bit by bit.
+"""
+
+import numpy as np
+import warnings
+warnings.filterwarnings("ignore")
+from box2dsim.envs import Box2DSimOneArmEnv, VecBox2DSim, \
+        SubprocVecBox2DSim
+
+num_envs = 4
+stime = 300
+seed = 1234
+init_range = [2.0, 2.0, 0.5]
+
+def serial():
+    joints = np.zeros([num_envs, stime, 7])
+    sensors = np.zeros([num_envs, stime, 1, 8])
+    obj_pos = np.zeros([num_envs, stime, 1, 2])
+    actions = np.zeros([num_envs, stime, 5])
+    for e in range(num_envs):
+        env = Box2DSimOneArmEnv()
+        env.object_init_range = init_range
+        env.seed(seed + e)
+        env.reset()
+        for t in range(stime):
+            actions[e, t] = env.action_space.sample()
+            observation, *_ = env.step(actions[e, t])
+            joints[e, t] = observation["JOINT_POSITIONS"]
+            sensors[e, t] = list(observation["TOUCH_SENSORS"].values())
+            obj_pos[e, t] = observation["OBJ_POSITION"][:, 0]
+    return actions, joints, sensors, obj_pos
+
+def batched(venv, actions):
+    joints = np.zeros([num_envs, stime, 7])
+    sensors = np.zeros([num_envs, stime, 1, 8])
+    obj_pos = np.zeros([num_envs, stime, 1, 2])
+    venv.reset()
+    for t in range(stime):
+        observation, *_ = venv.step(actions[:, t])
+        joints[:, t] = observation["JOINT_POSITIONS"]
+        sensors[:, t] = observation["TOUCH_SENSORS"]
+        obj_pos[:, t] = observation["OBJ_POSITION"]
+    return joints, sensors, obj_pos
+
+if __name__ == "__main__":
+
+    actions, *reference = serial()
+    # the same seed samples the same actions again
+    assert np.array_equal(actions, serial()[0])
+
+    venv = VecBox2DSim(num_envs)
+    venv.object_init_range = init_range
+    venv.seed(seed)
+    vec = batched(venv, actions)
+
+    venv = SubprocVecBox2DSim(num_envs, num_workers=2)
+    venv.set_object_init_range(init_range)
+    venv.seed(seed)
+    subproc = batched(venv, actions)
+    venv.close()
+
+    for name, result in [("VecBox2DSim", vec),
+            ("SubprocVecBox2DSim", subproc)]:
+        for key, x, y in zip(["joints", "touch sensors", "object positions"],
+                reference, result):
+            assert np.array_equal(x, y), "%s %s differ" % (name, key)
+        print("%s: bit-identical to serial runs" % name)